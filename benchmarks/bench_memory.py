@@ -0,0 +1,157 @@
+"""Memory benchmark of the device model
+
+Builds 10k sensors and lights from gateway-like payloads and reports the
+bytes retained per device, for the __slots__ based model of deconz_py and
+for the plain-class model it replaced (which also kept the raw payloads).
+Run with:
+
+    python benchmarks/bench_memory.py [count]
+"""
+
+import asyncio
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from deconz_py.deconz_light import DeCONZLight      # pylint: disable=wrong-import-position
+from deconz_py.deconz_sensor import DeCONZSensor    # pylint: disable=wrong-import-position
+
+SENSOR = json.dumps({
+    'config': {'battery': 90, 'offset': 0, 'on': True, 'reachable': True},
+    'ep': 1, 'etag': '1b7cf4e0d6b0c4a8f1e0b4f0a6a1b2c3',
+    'manufacturername': 'LUMI', 'modelid': 'lumi.weather',
+    'name': 'Temperature {id}', 'swversion': '20161129',
+    'state': {'lastupdated': '2019-03-26T10:12:00', 'temperature': 2153},
+    'type': 'ZHATemperature',
+    'uniqueid': '00:15:8d:00:01:{id:02x}:00:00-01-0402'})
+
+LIGHT = json.dumps({
+    'etag': '026bcfe544ad76c7534e5ca8ed39047c', 'hascolor': True,
+    'manufacturername': 'IKEA of Sweden',
+    'modelid': 'TRADFRI bulb E27 WS opal 980lm', 'name': 'Light {id}',
+    'state': {'alert': 'none', 'bri': 111, 'colormode': 'ct', 'ct': 307,
+              'effect': 'none', 'hue': 0, 'on': False, 'reachable': True,
+              'sat': 0, 'xy': [0.0, 0.0]},
+    'swversion': '1.2.217', 'type': 'Color temperature light',
+    'uniqueid': '00:0b:57:ff:fe:{id:02x}:00:00-01'})
+
+class LegacySensor: #pylint: disable=too-many-instance-attributes,too-few-public-methods
+    """The sensor model before __slots__, keeping the raw payloads."""
+
+    def __init__(self, dcz_id, name, device_type):
+        self._dcz_id = dcz_id
+        self._name = name
+        self._state = None
+        self._config = None
+        self._device_type = device_type
+        self._current_state = None
+        self._ep = None
+        self._etag = None
+        self._manufacturername = None
+        self._modelid = None
+        self._swversion = None
+        self._uniqueid = None
+        self._update_listeners = []
+
+    def update(self, data):
+        """Store the payload like the old update() did."""
+        self._state = data['state']
+        self._current_state = self._state['temperature']/float(100)
+        self._config = data['config']
+        for key in ('ep', 'etag', 'manufacturername', 'modelid',
+                    'swversion', 'uniqueid'):
+            setattr(self, '_' + key, data[key])
+
+class LegacyLight: #pylint: disable=too-many-instance-attributes,too-few-public-methods
+    """The light model before __slots__."""
+
+    def __init__(self, dcz_id, name, state, device_type):
+        self._dcz_id = dcz_id
+        self._name = name
+        self._device_type = device_type
+        self._api = None
+        self._is_group = False
+        self._current_state = state['on']
+        self._dimmer = state['bri']
+        self._ct_color = state['ct']
+        self._xy_color = state['xy']
+        self._hue = state['hue']
+        self._sat = state['sat']
+        self._reachable = state['reachable']
+        self._transition_time = None
+        self._alert = state['alert']
+        self._effect = state['effect']
+        self._colorloopspeed = None
+        self._colormode = state['colormode']
+        self._update = None
+        self._update_listeners = []
+
+def payloads(template, count):
+    """Return separately decoded payloads, like the gateway delivers them."""
+    return [json.loads(template.replace('{id}', str(index))
+                       .replace('{id:02x}', '{:02x}'.format(index % 256)))
+            for index in range(count)]
+
+def measure(build, template, count):
+    """Return the bytes per device retained by the devices build returns."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    data = payloads(template, count)
+    devices = build(data)
+    del data
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(devices) == count
+    return (after - before) / count
+
+def build_legacy_sensors(data):
+    """Build sensors with the old model."""
+    devices = []
+    for index, item in enumerate(data):
+        sensor = LegacySensor(str(index), item['name'], item['type'])
+        sensor.update(item)
+        devices.append(sensor)
+    return devices
+
+def build_sensors(data):
+    """Build sensors with the current model."""
+    devices = [DeCONZSensor(str(index), item['name'], item['type'])
+               for index, item in enumerate(data)]
+
+    async def update_all():
+        for sensor, item in zip(devices, data):
+            await sensor.update(item)
+
+    asyncio.run(update_all())
+    return devices
+
+def build_legacy_lights(data):
+    """Build lights with the old model."""
+    return [LegacyLight(str(index), item['name'], item['state'], item['type'])
+            for index, item in enumerate(data)]
+
+def build_lights(data):
+    """Build lights with the current model."""
+    return [DeCONZLight(str(index), item['name'], item['state'],
+                        item['type'], api=None)
+            for index, item in enumerate(data)]
+
+def main(count=10000):
+    """Print the bytes per device of both models."""
+    print('{} devices'.format(count))
+    for name, legacy, current, template in (
+            ('sensor', build_legacy_sensors, build_sensors, SENSOR),
+            ('light', build_legacy_lights, build_lights, LIGHT)):
+        old = measure(legacy, template, count)
+        new = measure(current, template, count)
+        print('{:<7} legacy {:7.0f} B/device  slots {:7.0f} B/device'
+              .format(name, old, new))
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,97 @@
+"""Micro-benchmark of the sensor state decoding
+
+Compares the decoder table of DeCONZSensor with the if/elif chain it
+replaced, for a mix of sensor types. Run with:
+
+    python benchmarks/bench_sensor_decode.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from deconz_py.deconz_sensor import DeCONZSensor    # pylint: disable=wrong-import-position
+
+EVENTS = [
+    ('ZHATemperature', {'temperature': 2153}),
+    ('ZHAHumidity', {'humidity': 4711}),
+    ('ZHAPressure', {'pressure': 1013}),
+    ('ZHALightLevel', {'lightlevel': 24000}),
+    ('ZHASwitch', {'buttonevent': 1002}),
+    ('ZHAPresence', {'presence': True}),
+    ('ZHAOpenClose', {'open': False}),
+    ('CLIPGenericStatus', {'status': 3}),
+]
+
+def legacy_decode(device_type, state): #pylint: disable=too-many-branches,too-many-return-statements
+    """The if/elif chain used before the decoder table."""
+    try:
+        if device_type == DeCONZSensor.ZHATEMPERATURE or \
+           device_type == DeCONZSensor.CLIPTEMPERATURE:
+            return state['temperature']/float(100)
+        elif device_type == DeCONZSensor.ZHAHUMIDITY or \
+             device_type == DeCONZSensor.CLIPHUMIDITY:
+            return state['humidity']/float(100)
+        elif device_type == DeCONZSensor.ZHAPRESSURE:
+            return state['pressure']
+        elif device_type == DeCONZSensor.ZHALIGHTLEVEL:
+            return round(10 ** (float(state['lightlevel'] - 1) / 10000), 0)
+        elif device_type == DeCONZSensor.ZHASWITCH or \
+             device_type == DeCONZSensor.CLIPSWITCH:
+            return state['buttonevent']
+        elif device_type == DeCONZSensor.ZHAPRESENCE or \
+             device_type == DeCONZSensor.CLIPPRESENCE:
+            return state['presence']
+        elif device_type == DeCONZSensor.ZHAOPENCLOSE or \
+             device_type == DeCONZSensor.CLIPOPENCLOSE:
+            return state['open']
+        elif device_type == DeCONZSensor.ZHAWATER or \
+             device_type == DeCONZSensor.CLIPWATER:
+            return state['water']
+        elif device_type == DeCONZSensor.ZHAALARM or \
+             device_type == DeCONZSensor.CLIPALARM:
+            return state['alarm']
+        elif device_type == DeCONZSensor.CLIPGENERICFLAG:
+            return state['flag']
+        elif device_type == DeCONZSensor.CLIPGENERICSTATUS:
+            return state['status']
+        return "unknown"
+    except KeyError:
+        return "unknown"
+
+def table_decode(decoder, state):
+    """The decoder table path, the decoder is resolved at construction."""
+    try:
+        return decoder(state)
+    except KeyError:
+        return "unknown"
+
+def main(number=200000):
+    """Run both variants and print the time per decoded event."""
+    legacy_events = EVENTS
+    table_events = [(DeCONZSensor.DECODERS[device_type], state)
+                    for device_type, state in EVENTS]
+
+    for (device_type, state), (decoder, _) in zip(legacy_events,
+                                                  table_events):
+        assert legacy_decode(device_type, state) == \
+            table_decode(decoder, state), device_type
+
+    def run_legacy():
+        for device_type, state in legacy_events:
+            legacy_decode(device_type, state)
+
+    def run_table():
+        for decoder, state in table_events:
+            table_decode(decoder, state)
+
+    for name, func in (('if/elif chain', run_legacy),
+                       ('decoder table', run_table)):
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print('{:<14} {:8.1f} ns/event'.format(
+            name, best / (number * len(EVENTS)) * 1e9))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""In-process fake deCONZ gateway
+
+Serves the REST tree of a deCONZ gateway and pushes websocket events, so
+DeCONZApi can be exercised without hardware. Latency, HTTP errors and
+websocket disconnects can be injected. All generated data is derived from
+a seed, so runs are reproducible.
+"""
+
+import asyncio
+import json
+import random
+
+from aiohttp import web, WSMsgType
+
+SENSOR_TYPES = (('ZHATemperature', 'temperature', 2000),
+                ('ZHAHumidity', 'humidity', 4500),
+                ('ZHAPressure', 'pressure', 1000),
+                ('ZHALightLevel', 'lightlevel', 20000),
+                ('ZHAPresence', 'presence', False),
+                ('ZHAOpenClose', 'open', False))
+
+class FakeGateway: #pylint: disable=too-many-instance-attributes
+    """A deCONZ gateway serving REST and websocket on two local ports."""
+
+    def __init__(self, api_key='benchmark', sensors=0, lights=0, groups=0, #pylint: disable=too-many-arguments
+                 group_size=4, latency=0.0, error_rate=0.0, seed=0):
+        """Initialize the gateway with generated devices.
+
+        latency is added to every REST response in seconds, error_rate is
+        the share of REST requests answered with HTTP 503.
+        """
+        self.api_key = api_key
+        self.latency = latency
+        self.error_rate = error_rate
+        self.websocket_enabled = True
+        self.port = None
+        self.ws_port = None
+        self.requests = 0
+        self.commands = 0
+        self._random = random.Random(seed)
+        self._etag = 0
+        self._clients = set()
+        self._runner = None
+        self._tree = {'sensors': {}, 'lights': {}, 'groups': {},
+                      'config': {'name': 'fake', 'websocketport': None}}
+        for index in range(1, sensors + 1):
+            self._tree['sensors'][str(index)] = self._sensor(index)
+        for index in range(1, lights + 1):
+            self._tree['lights'][str(index)] = self._light(index)
+        light_ids = list(self._tree['lights'])
+        for index in range(1, groups + 1):
+            members = light_ids[(index - 1) * group_size:index * group_size]
+            self._tree['groups'][str(index)] = self._group(index, members)
+
+    @property
+    def tree(self):
+        """Return the full REST tree served at /api/<key>/."""
+        return self._tree
+
+    @property
+    def connected(self):
+        """Return the number of connected websocket clients."""
+        return len(self._clients)
+
+    async def start(self, host='127.0.0.1'):
+        """Start serving on two free ports."""
+        app = web.Application()
+        app.router.add_get('/', self._handle_websocket)
+        app.router.add_get('/api/{key}/', self._handle_get)
+        app.router.add_get('/api/{key}/{resource}', self._handle_get)
+        app.router.add_get('/api/{key}/{resource}/{dcz_id}', self._handle_get)
+        app.router.add_put('/api/{key}/{resource}/{dcz_id}/{action}',
+                           self._handle_put)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        rest = web.TCPSite(self._runner, host, 0)
+        websocket = web.TCPSite(self._runner, host, 0)
+        await rest.start()
+        await websocket.start()
+        self.port = rest._server.sockets[0].getsockname()[1]    # pylint: disable=protected-access
+        self.ws_port = websocket._server.sockets[0].getsockname()[1]    # pylint: disable=protected-access
+        self._tree['config']['websocketport'] = self.ws_port
+
+    async def stop(self):
+        """Disconnect all clients and stop serving."""
+        await self.disconnect()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def disconnect(self):
+        """Close all websocket connections."""
+        clients, self._clients = self._clients, set()
+        for client in clients:
+            await client.close()
+
+    async def push(self, event):
+        """Send an event to all connected websocket clients."""
+        frame = json.dumps(event)
+        for client in list(self._clients):
+            if not client.closed:
+                await client.send_str(frame)
+
+    def sensor_event(self, dcz_id=None, **state):
+        """Change a sensor and return the matching 'changed' event.
+
+        Without dcz_id a sensor is picked at random, state defaults to a
+        new random value of its primary attribute.
+        """
+        sensors = self._tree['sensors']
+        if dcz_id is None:
+            dcz_id = self._random.choice(list(sensors))
+        sensor = sensors[dcz_id]
+        if not state:
+            field, value = _primary(sensor)
+            state = {field: _vary(self._random, value)}
+        sensor['state'].update(state)
+        sensor['etag'] = self._next_etag()
+        return {'e': 'changed', 'id': dcz_id, 'r': 'sensors',
+                't': 'event', 'state': state}
+
+    async def push_sensor_events(self, count, rate=None):
+        """Push count sensor events, at most rate per second if given."""
+        interval = 1.0 / rate if rate else 0
+        for _ in range(count):
+            await self.push(self.sensor_event())
+            await asyncio.sleep(interval)
+
+    async def _handle_websocket(self, request):
+        if not self.websocket_enabled:
+            raise web.HTTPServiceUnavailable()
+        client = web.WebSocketResponse()
+        await client.prepare(request)
+        self._clients.add(client)
+        async for message in client:
+            if message.type == WSMsgType.ERROR:
+                break
+        self._clients.discard(client)
+        return client
+
+    async def _respond(self, request):
+        self.requests += 1
+        if request.match_info['key'] != self.api_key:
+            raise web.HTTPForbidden()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise web.HTTPServiceUnavailable()
+
+    async def _handle_get(self, request):
+        await self._respond(request)
+        data = self._tree
+        for key in ('resource', 'dcz_id'):
+            if key in request.match_info:
+                data = data.get(request.match_info[key])
+                if data is None:
+                    raise web.HTTPNotFound()
+        return web.json_response(data)
+
+    async def _handle_put(self, request):
+        await self._respond(request)
+        resource = request.match_info['resource']
+        dcz_id = request.match_info['dcz_id']
+        action = request.match_info['action']
+        device = self._tree.get(resource, {}).get(dcz_id)
+        if device is None or action not in ('state', 'action'):
+            raise web.HTTPNotFound()
+        self.commands += 1
+        payload = await request.json()
+        section = device.setdefault(action, {})
+        section.update(payload)
+        device['etag'] = self._next_etag()
+        prefix = '/{}/{}/{}/'.format(resource, dcz_id, action)
+        await self.push({'e': 'changed', 'id': dcz_id, 'r': resource,
+                         't': 'event', 'state': dict(payload)})
+        return web.json_response([{'success': {prefix + key: value}}
+                                  for key, value in payload.items()])
+
+    def _next_etag(self):
+        self._etag += 1
+        return '{:032x}'.format(self._etag)
+
+    def _sensor(self, index):
+        device_type, field, value = SENSOR_TYPES[index % len(SENSOR_TYPES)]
+        return {'config': {'battery': 100 - index % 100, 'on': True,
+                           'reachable': True},
+                'ep': 1, 'etag': self._next_etag(),
+                'manufacturername': 'LUMI', 'modelid': 'lumi.sensor',
+                'name': 'Sensor {}'.format(index), 'swversion': '20161129',
+                'state': {'lastupdated': '2019-03-26T10:00:00',
+                          field: value},
+                'type': device_type,
+                'uniqueid': '00:15:8d:00:{:06x}-01'.format(index)}
+
+    def _light(self, index):
+        return {'etag': self._next_etag(), 'hascolor': True,
+                'manufacturername': 'IKEA of Sweden',
+                'modelid': 'TRADFRI bulb E27 WS opal 980lm',
+                'name': 'Light {}'.format(index), 'swversion': '1.2.217',
+                'state': {'alert': 'none', 'bri': 111, 'colormode': 'ct',
+                          'ct': 307, 'effect': 'none', 'hue': 0,
+                          'on': False, 'reachable': True, 'sat': 0,
+                          'xy': [0.0, 0.0]},
+                'type': 'Color temperature light',
+                'uniqueid': '00:0b:57:ff:fe:{:06x}-01'.format(index)}
+
+    def _group(self, index, members):
+        return {'action': {'bri': 111, 'ct': 307, 'on': False},
+                'etag': self._next_etag(), 'lights': members,
+                'name': 'Group {}'.format(index),
+                'state': {'all_on': False, 'any_on': False},
+                'type': 'LightGroup'}
+
+def _primary(sensor):
+    for key, value in sensor['state'].items():
+        if key != 'lastupdated':
+            return key, value
+    return 'status', 0
+
+def _vary(rand, value):
+    if isinstance(value, bool):
+        return not value
+    return value + rand.choice((-1, 1)) * rand.randint(1, 50)
@@ -0,0 +1,214 @@
+"""Load and latency benchmarks of DeCONZApi against the fake gateway
+
+Measures async_load time against the device count, websocket
+event-to-listener latency, set_light command throughput and the memory
+retained per loaded device. Data and event sequences are seeded, so runs
+are comparable between commits. Run with:
+
+    python benchmarks/run.py [--quick] [--json results.json]
+                             [--baseline baseline.json [--tolerance 0.25]]
+
+With --baseline the results are compared with those of an earlier --json
+run on the same machine, and the exit status is 1 if any of them is worse
+by more than the tolerance, 0.25 meaning 25 %.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from deconz_py import DeCONZApi, DeCONZScheduler    # pylint: disable=wrong-import-position
+from fake_gateway import FakeGateway    # pylint: disable=wrong-import-position
+
+# results checked against a baseline, and whether higher values are better.
+# Loading 100 devices takes a few milliseconds, too little to compare.
+CHECKED = ((('load_seconds', '1000'), False),
+           (('event_latency_ms', 'p95'), False),
+           (('set_light', 'puts_per_second'), True),
+           (('bytes_per_device',), False))
+
+def percentile(values, share):
+    """Return the value below which the given share of values falls."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+async def _started(gateway, **options):
+    await gateway.start()
+    api = DeCONZApi('127.0.0.1', gateway.port, gateway.ws_port,
+                    gateway.api_key, **options)
+    return api
+
+async def bench_load(count, repeat):
+    """Return the median async_load time in seconds for count devices."""
+    gateway = FakeGateway(sensors=count // 2, lights=count - count // 2,
+                          groups=count // 40)
+    await gateway.start()
+    timings = []
+    try:
+        for _ in range(repeat):
+            api = DeCONZApi('127.0.0.1', gateway.port, gateway.ws_port,
+                            gateway.api_key)
+            start = time.perf_counter()
+            await api.async_load()
+            timings.append(time.perf_counter() - start)
+            await api.async_stop()
+    finally:
+        await gateway.stop()
+    return statistics.median(timings)
+
+async def bench_event_latency(events, rate):
+    """Return event-to-listener latencies in milliseconds."""
+    gateway = FakeGateway(sensors=50, seed=1)
+    api = await _started(gateway)
+    loop = asyncio.get_event_loop()
+    sent = {}
+    latencies = []
+
+    def listener(data):
+        seq = data.get('state', {}).get('bench_seq')
+        if seq in sent:
+            latencies.append((loop.time() - sent.pop(seq)) * 1000)
+
+    try:
+        await api.async_load()
+        for sensor in api.get_devices('sensors').values():
+            sensor.add_update_listener(listener)
+        while not gateway.connected:
+            await asyncio.sleep(0.01)
+        for seq in range(events):
+            event = gateway.sensor_event()
+            event['state']['bench_seq'] = seq
+            sent[seq] = loop.time()
+            await gateway.push(event)
+            await asyncio.sleep(1.0 / rate)
+        await asyncio.sleep(0.5)
+    finally:
+        await api.async_stop()
+        await gateway.stop()
+    return latencies
+
+async def bench_throughput(commands):
+    """Return acknowledged PUTs per second and the PUTs sent.
+
+    Every command goes to another light, so none of them are merged and
+    each one is a PUT of its own.
+    """
+    gateway = FakeGateway(lights=commands, seed=2)
+    # the fake gateway has no Zigbee queue to protect, measure the client
+    api = await _started(gateway, scheduler=DeCONZScheduler(light_rate=None,
+                                                            group_rate=None))
+    try:
+        await api.async_load()
+        devices = list(api.get_devices('lights').values())
+        start = time.perf_counter()
+        calls = []
+        for index, light in enumerate(devices):
+            light.brightness = index % 254 + 1
+            calls.append(light.turn_on())
+        results = await asyncio.gather(*calls)
+        elapsed = time.perf_counter() - start
+    finally:
+        await api.async_stop()
+        await gateway.stop()
+    acknowledged = sum(1 for result in results if result is not False)
+    return acknowledged / elapsed, gateway.commands
+
+async def bench_memory(count):
+    """Return the bytes retained per device after async_load."""
+    gateway = FakeGateway(sensors=count // 2, lights=count - count // 2)
+    api = await _started(gateway)
+    try:
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        await api.async_load()
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    finally:
+        await api.async_stop()
+        await gateway.stop()
+    return (after - before) / count
+
+async def run(quick):
+    """Run all benchmarks and return the results."""
+    counts = (100, 1000) if quick else (100, 1000, 5000)
+    results = {'load_seconds': {}}
+    for count in counts:
+        seconds = await bench_load(count, repeat=3)
+        results['load_seconds'][count] = seconds
+        print('async_load  {:>6} devices {:8.1f} ms'.format(count,
+                                                           seconds * 1000))
+
+    latencies = await bench_event_latency(200 if quick else 2000, rate=500)
+    results['event_latency_ms'] = {
+        'received': len(latencies),
+        'p50': percentile(latencies, 0.5),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99)}
+    print('event latency p50 {p50:.2f} ms  p95 {p95:.2f} ms  p99 {p99:.2f} ms'
+          .format(**results['event_latency_ms']))
+
+    rate, puts = await bench_throughput(500 if quick else 5000)
+    results['set_light'] = {'puts_per_second': rate, 'puts': puts}
+    print('set_light   {:8.0f} PUTs/s  ({} PUTs sent)'.format(rate, puts))
+
+    per_device = await bench_memory(1000 if quick else 10000)
+    results['bytes_per_device'] = per_device
+    print('memory      {:8.0f} B/device'.format(per_device))
+    return results
+
+def regressions(results, baseline, tolerance):
+    """Return a line for every checked result worse than the baseline."""
+    # results read back from JSON have string keys only
+    results = json.loads(json.dumps(results))
+    lines = []
+    for path, higher_is_better in CHECKED:
+        value, reference = results, baseline
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+            reference = reference.get(key) \
+                if isinstance(reference, dict) else None
+        if value is None or not reference:
+            continue
+        change = (value - reference) / reference
+        if higher_is_better:
+            change = -change
+        if change > tolerance:
+            lines.append('{} {:.4g} is {:.0%} worse than {:.4g}'.format(
+                '.'.join(path), value, change, reference))
+    return lines
+
+def main():
+    """Parse the arguments and run the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true',
+                        help='smaller sizes, for CI')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline',
+                        help='fail if worse than the results in this file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed share a result may be worse by')
+    args = parser.parse_args()
+    results = asyncio.run(run(args.quick))
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            failed = regressions(results, json.load(baseline), args.tolerance)
+        for line in failed:
+            print('REGRESSION', line)
+        if failed:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
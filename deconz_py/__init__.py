@@ -1,5 +1,14 @@
 """Module to control deCONZ over the REST Api"""
 
 from .deconz_api import DeCONZApi
+from .deconz_codec import get_codec
+from .deconz_device import DeCONZDevice
+from .deconz_history import SensorHistory
 from .deconz_sensor import DeCONZSensor
 from .deconz_light import DeCONZLight
+from .deconz_manager import DeCONZManager
+from .deconz_metrics import DeCONZMetrics
+from .deconz_recorder import FrameRecorder
+from .deconz_retry import RetryPolicy
+from .deconz_scheduler import DeCONZScheduler
+from .deconz_sync import DeCONZSyncApi
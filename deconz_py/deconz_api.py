@@ -2,181 +2,386 @@
 
 import logging
 import asyncio
-import json
+import re
+import time
 
 import aiohttp
 import async_timeout
 
-from tenacity import *
+from .deconz_retry import RetryPolicy
 from .deconz_sensor import DeCONZSensor
 from .deconz_light import DeCONZLight
+from .deconz_codec import get_codec
+from .deconz_dispatch import DeCONZDispatcher
+from .deconz_groups import plan_commands
+from .deconz_history import SensorHistory
+from .deconz_metrics import DeCONZMetrics
+from .deconz_queue import DeCONZCommandQueue
+from .deconz_recorder import capture_files, replay_capture
+from .deconz_registry import DeCONZRegistry
+from .deconz_scheduler import DeCONZScheduler
+from .deconz_snapshot import read_snapshot, write_snapshot
 
 _LOGGER = logging.getLogger(__name__)
 
+# lastupdated is an ISO timestamp, or "none" if the sensor never reported
+_TIMESTAMP = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}')
+
 class DeCONZApi:
     """Simple binding for the Lundix SPC Web Gateway REST API."""
-    def __init__(self, host, port, ws_port, api_key):
-        """Initialize the web gateway client."""
+
+    # seconds async_load waits for the websocket before loading without it
+    WS_CONNECT_TIMEOUT = 10.0
+    # seconds closing the websocket waits for the gateway to confirm. While
+    # the dispatch queue is full the unread frames hold back its answer.
+    WS_CLOSE_TIMEOUT = 1.0
+
+    def __init__(self, host, port, ws_port, api_key, #pylint: disable=too-many-arguments
+                 limit_per_host=4, keepalive_timeout=30, coalesce_window=0.05,
+                 read_retry=None, write_retry=None, ws_reconnect=None,
+                 dispatch_workers=4, dispatch_queue_size=1000,
+                 dispatch_overflow=DeCONZDispatcher.BLOCK,
+                 keep_raw_payloads=False, metrics=None, session=None,
+                 codec=None, skip_unsubscribed_events=False,
+                 snapshot_path=None, history_size=0, history_retention=None,
+                 scheduler=None, recorder=None, poll_interval=5.0,
+                 max_poll_interval=60.0):
+        """Initialize the web gateway client.
+
+        limit_per_host caps the number of pooled connections to the gateway,
+        keepalive_timeout is the number of seconds an idle connection is kept
+        and coalesce_window is the time in seconds state writes for the same
+        light or group are merged before they are sent.
+        read_retry and write_retry are RetryPolicy instances for data
+        requests and light commands, the backoff of ws_reconnect (also a
+        RetryPolicy) sets the delays between websocket reconnect attempts.
+        Websocket events are queued for dispatch_workers workers, at most
+        dispatch_queue_size events are queued before dispatch_overflow
+        ('block' or 'drop_oldest') applies. Sensors keep their raw state
+        and config dicts only if keep_raw_payloads is set. metrics is a
+        DeCONZMetrics instance (or True for a new one) to collect metrics
+        in, by default none are collected. If an aiohttp session is given
+        it is used for all REST calls and left open on stop, so several
+        gateways can share one connection pool.
+        codec is the JSONCodec used for all payloads, by default the fastest
+        available one. With skip_unsubscribed_events 'changed' events for
+        devices without update listeners are dropped before they are
+        dispatched; those devices are then only refreshed by a resync.
+        With snapshot_path the devices are saved to that file after loading
+        and on stop, and the next load serves them from it at once.
+        With history_size every sensor keeps its last history_size numeric
+        readings, at most history_retention seconds old, in a SensorHistory.
+        scheduler is the DeCONZScheduler rate limiting light and group
+        commands, by default one with the limits recommended for a gateway.
+        Raw websocket frames are written to recorder, a FrameRecorder, if
+        given; async_replay feeds such a capture back.
+        While the websocket is down the devices are polled, every
+        poll_interval seconds at first and up to max_poll_interval seconds
+        while nothing changes. poll_interval None disables polling.
+        """
         self._host = host
         self._port = port
         self._api_key = api_key
         self._ws_port = ws_port
         self._ws = None
         self._ws_task = None
-        self._device_list = {'sensors':{}, 'lights':{}, 'groups':{}}
+        self._ws_ready = None
+        self._limit_per_host = limit_per_host
+        self._keepalive_timeout = keepalive_timeout
+        self._session = session
+        self._owns_session = session is None
+        if metrics is True:
+            metrics = DeCONZMetrics()
+        self._metrics = metrics or None
+        self._read_retry = read_retry or RetryPolicy(deadline=30.0)
+        self._write_retry = write_retry or RetryPolicy(attempts=4,
+                                                       deadline=5.0)
+        self._commands = DeCONZCommandQueue(self._set_state, coalesce_window,
+                                            self._write_retry, self._metrics,
+                                            scheduler or DeCONZScheduler())
+        self._ws_reconnect = ws_reconnect or RetryPolicy(initial_delay=0.25,
+                                                         max_delay=30.0)
+        self._ws_stats = {'reconnects': 0, 'last_gap': None,
+                          'max_gap': 0.0, 'total_gap': 0.0, 'polls': 0}
+        self._poll_interval = poll_interval
+        self._max_poll_interval = max_poll_interval
+        self._poll_task = None
+        self._keep_raw_payloads = keep_raw_payloads
+        self._codec = codec or get_codec()
+        self._skip_unsubscribed_events = skip_unsubscribed_events
+        self._snapshot_path = snapshot_path
+        self._history_size = history_size
+        self._history_retention = history_retention
+        self._recorder = recorder
+        self._revalidate_task = None
+        self._registry = DeCONZRegistry()
+        # category -> websocket events buffered while it is loaded
+        self._loading = {}
+        self._dispatcher = DeCONZDispatcher(self._async_process_message,
+                                            dispatch_workers,
+                                            dispatch_queue_size,
+                                            dispatch_overflow,
+                                            self._metrics)
+        self._event_handlers = {'changed': self._async_device_changed,
+                                'added': self._async_device_added,
+                                'deleted': self._async_device_deleted}
 
-    def load(self):
-        """Retrieve all available sensors."""
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(self.async_load())
+    async def __aenter__(self):
+        await self.async_load()
+        return self
 
-    @asyncio.coroutine
-    def async_load(self):
-        """Retrieve all available sensors."""
-        async_data = yield from self.get_data('')
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.async_stop()
 
-        for dcz_id, data in async_data['sensors'].items():
-            sensor = DeCONZSensor(dcz_id,
-                                  name=data['name'],
-                                  device_type=data['type'])
-            yield from sensor.update(data)
-            yield from self._add_device('sensors', dcz_id, sensor)
-
-        for dcz_id, data in async_data['lights'].items():
-            light = DeCONZLight(dcz_id,
-                                name=data['name'],
-                                device_type=data['type'],
-                                state=data['state'],
-                                api=self)
-            yield from self._add_device('lights', dcz_id, light)
-        for dcz_id, data in async_data['groups'].items():
-            group = DeCONZLight(dcz_id,
-                                name=data['name'],
-                                device_type=data['type'],
-                                state=data['state'],
-                                api=self)
-            yield from self._add_device('groups', dcz_id, group)
-
-        #self._ws_port = async_data['config']['websocketport']
-        if hasattr(asyncio, 'ensure_future'):
-           ensure_future = asyncio.ensure_future
-        else:  # use of async keyword has been Deprecated since Python 3.4.4
-           ensure_future =  getattr(asyncio, "async")
-
-        ensure_future(self._ws_listen(self._async_process_message))
-
-    def stop(self):
-        """Stop the websocket listener and clear devices."""
+    async def async_load(self):
+        """Retrieve all available devices and subscribe to their events.
+
+        The websocket is subscribed first and its events are buffered until
+        the category they belong to is loaded. Sensors, lights and groups
+        are fetched concurrently, each category is available as soon as it
+        is loaded. If a snapshot is found the devices are restored from it
+        and this returns at once; they are revalidated in the background
+        and only the devices whose etag changed are updated. Raises
+        ConnectionError if a category can not be fetched.
+        """
+        try:
+            await self._open_session()
+            restored = self._snapshot_path is not None and \
+                await self._async_restore_snapshot()
+            self._loading = {category: [] for category in
+                             DeCONZRegistry.CATEGORIES}
+            self._ws_ready = asyncio.Event()
+            self._dispatcher.start()
+            self._ws_task = asyncio.ensure_future(
+                self._ws_listen(self._dispatcher.put))
+            if restored:
+                self._revalidate_task = asyncio.ensure_future(
+                    self._async_revalidate())
+                return
+            await self._async_wait_for_websocket()
+            await self._async_load_all()
+        except BaseException:
+            # do not leave the listener or the dispatcher running
+            await self._async_shutdown(save_snapshot=False)
+            raise
+
+    async def async_save_snapshot(self):
+        """Write all known devices to the snapshot file."""
+        snapshot = {'gateway': self._gateway_id}
+        for category in DeCONZRegistry.CATEGORIES:
+            snapshot[category] = {
+                dcz_id: device.snapshot() for dcz_id, device in
+                self._registry.category(category).items()}
         loop = asyncio.get_event_loop()
-        loop.run_until_complete(self.async_stop())
-        loop.close()
-
-    @asyncio.coroutine
-    def async_stop(self):
-        """Stop the websocket listener and clear devices."""
-        for task in asyncio.Task.all_tasks():
-            task.cancel()
+        try:
+            await loop.run_in_executor(None, write_snapshot,
+                                       self._snapshot_path, snapshot,
+                                       self._codec)
+        except OSError as err:
+            _LOGGER.error("Failed to write snapshot %s: %s",
+                          self._snapshot_path, err)
+
+    async def async_stop(self):
+        """Stop the websocket listener and clear devices.
+
+        Only the tasks started by this instance are cancelled. With a
+        snapshot_path the devices are saved before they are cleared.
+        """
+        await self._async_shutdown(save_snapshot=True)
+
+    async def _async_shutdown(self, save_snapshot):
+        if self._revalidate_task is not None:
+            self._revalidate_task.cancel()
+            await asyncio.wait([self._revalidate_task])
+            self._revalidate_task = None
+        if self._ws_task is not None:
+            self._ws_task.cancel()
+            await asyncio.wait([self._ws_task])
+            self._ws_task = None
+        self._loading = {}
+        self._commands.cancel()
+        await self._dispatcher.stop()
         if self._ws:
-            self._ws_close()
-        if self._device_list:
-            del self._device_list
+            await self._ws_close()
+        if self._recorder is not None:
+            self._recorder.close()
+        await self._close_session()
+        if save_snapshot and self._snapshot_path is not None and \
+                len(self._registry):
+            await self.async_save_snapshot()
+        self._registry.clear()
+
+    @property
+    def session(self):
+        """Return the aiohttp session used for REST calls."""
+        return self._session
+
+    @session.setter
+    def session(self, session):
+        """Use a shared aiohttp session, it is left open on stop."""
+        self._session = session
+        self._owns_session = False
+
+    @property
+    def host(self):
+        """Return the host of the gateway."""
+        return self._host
 
     def get_devices(self, category):
         """Retrieve all available devices in this category."""
-        if category in self._device_list:
-            return self._device_list[category]
+        if category in DeCONZRegistry.CATEGORIES:
+            return self._registry.category(category)
         else:
             raise AttributeError('Category not supported')
-            
-    @asyncio.coroutine
-    def set_light(self, light):
-        """Retrieve all available sensors."""
-        return (yield from self._set_state(light))
-
-    @asyncio.coroutine
-    def get_data(self, resource):
-        """Get data from the gateway"""
-        return (yield from self._call_web_gateway(resource))
 
-    @asyncio.coroutine
-    def _add_device(self, category, dcz_id, device):
-        self._device_list[category][dcz_id] = device
+    @property
+    def websocket_stats(self):
+        """Return reconnect count, disconnected time in seconds and polls.
 
-    @asyncio.coroutine
-    def _async_process_message(self, message):
-        _LOGGER.debug(message)
+        polling is True while the devices are polled instead.
+        """
+        stats = dict(self._ws_stats)
+        stats['polling'] = self._poll_task is not None
+        return stats
 
-        device = self._device_list.get(message['r']).get(message['id'], None)
+    @property
+    def metrics(self):
+        """Return the DeCONZMetrics instance or None if disabled."""
+        return self._metrics
 
-        if message['e'] == 'changed' and device:
-            yield from device.update(message)
-        #elif message['e'] == 'added':
-        #elif message['e'] == 'deleted' and devices:
-        else:
-            _LOGGER.warning("Unsuccessful websocket message delivered, ignoring: %s", message)
-        
-    def is_false(value):
-        """Return True if value is False"""
-        return value is False
-    
-    @retry(stop=stop_after_attempt(5),
-           wait=wait_fixed(3),
-           retry=retry_if_result(is_false))
-    @asyncio.coroutine
-    def _set_state(self, light):
-        if light.is_group:
-            resource = 'groups'
-            action_string = 'action'
-        else:
-            resource = 'lights'
-            action_string = 'state'
-        url = 'http://{host}:{port}/api/{api_key}/{resource}/{light_id}/{' \
-              'action}'.format(host=self._host, port=self._port,
-                               api_key=self._api_key, resource=resource,
-                               light_id=light.dcz_id, action=action_string)
+    @property
+    def dispatch_stats(self):
+        """Return event queue depth, dispatch lag and dropped events."""
+        return self._dispatcher.stats
 
-        data = {'on': light.is_on, 'transitiontime': light.transition_time}
+    def query(self, category=None, battery_below=None, **criteria):
+        """Return the devices matching all criteria from the indexes.
 
-        if light.is_on: #turn on lights
-        
-            if light.refresh == 'bri': 
-                data['bri'] = light.brightness
-            elif light.refresh == 'hs': 
-                data['effect'] = 'none'
-                if light.hue is not None:
-                    data['hue'] = light.hue
-                if light.sat is not None:
-                    data['sat'] = light.sat
-            elif light.refresh == 'ct': 
-                if light.color_temp is not None:
-                    data['effect'] = 'none'
-                    data['ct'] = light.color_temp
-            elif light.refresh == 'xy': 
-                if light.xy_color is not None:
-                    data['effect'] = 'none'
-                    data['xy'] = light.xy_color
-            elif light.refresh == 'alert': 
-                if light.alert is not None:
-                    data['effect'] = 'none'
-                    data['alert'] = light.alert
-                    del data['on']
-            elif light.refresh == 'effect': 
-                if light.effect is not None:
-                    data['effect'] = light.effect
-                    data['colorloopspeed'] = light.colorloopspeed
-                   
-        json_data = json.dumps(data)
+        criteria are device_type, manufacturername, modelid, reachable or
+        battery with the wanted value, battery_below selects devices with a
+        lower battery level, e.g. query('sensors', reachable=False).
+        """
+        return self._registry.query(category, battery_below, **criteria)
+
+    def get_device_by_uniqueid(self, uniqueid):
+        """Return the device with the given uniqueid or None."""
+        return self._registry.by_uniqueid(uniqueid)
+
+    def export_history(self, window=None):
+        """Return the readings of all sensors keeping a history.
+
+        The result maps sensor ids to a (timestamps, values) pair of arrays,
+        oldest first, limited to the last window seconds if given.
+        """
+        now = time.time()
+        sensors = self._registry.category('sensors')
+        return {dcz_id: sensor.history.export(window, now)
+                for dcz_id, sensor in sensors.items()
+                if sensor.history is not None}
+
+    @property
+    def command_stats(self):
+        """Return the commands sent and their queue wait by priority."""
+        return self._commands.scheduler.stats
+
+    async def async_replay(self, path, speed=1.0):
+        """Process the websocket frames of a FrameRecorder capture.
+
+        The frames of path and its rotated files are passed through the
+        same processing as live events, with the recorded timing divided
+        by speed or as fast as possible if speed is None. The devices have
+        to be loaded before. Returns the number of frames and the largest
+        delay behind the recorded schedule in seconds.
+        """
+        return await replay_capture(capture_files(path),
+                                    self._async_process_message,
+                                    self._codec.loads, speed)
+
+    def set_light(self, light, priority=DeCONZScheduler.INTERACTIVE):
+        """Queue the state of the light, return a future for the result.
+
+        Changes for the same light or group queued within the coalescing
+        window are merged and sent as one command. priority is one of the
+        DeCONZScheduler priorities.
+        """
+        resource = 'groups' if light.is_group else 'lights'
+        return self._commands.submit(resource, light.dcz_id,
+                                     self._light_payload(light), priority)
+
+    async def async_set_lights(self, lights, state,
+                               priority=DeCONZScheduler.INTERACTIVE):
+        """Send the same state to several lights with as few commands as possible.
+
+        lights are DeCONZLight instances or light ids, state is a deCONZ
+        state dict like {'on': True, 'bri': 128}. Groups whose members are
+        all part of the request are commanded with one group action, the
+        remaining lights one by one. Returns a dict mapping (resource, id)
+        to the gateway result of every command sent. All commands are
+        queued with priority.
+        """
+        light_ids = {getattr(light, 'dcz_id', light) for light in lights}
+        group_ids, light_ids = plan_commands(
+            light_ids, self._registry.groups_by_members)
+        targets = [('groups', group_id) for group_id in group_ids] + \
+                  [('lights', light_id) for light_id in light_ids]
+        results = await asyncio.gather(
+            *(self._commands.submit(resource, dcz_id, dict(state), priority)
+              for resource, dcz_id in targets), return_exceptions=True)
+        return dict(zip(targets, results))
+
+    def get_group_lights(self, group_id):
+        """Return the ids of the member lights of a group."""
+        return self._registry.group_lights(group_id)
+
+    def get_light_groups(self, light_id):
+        """Return the ids of the groups a light belongs to."""
+        return self._registry.light_groups(light_id)
+
+    async def get_data(self, resource):
+        """Get data from the gateway"""
+        if self._metrics is None:
+            return (await self._read_retry.call(self._call_web_gateway,
+                                                resource))
+        return (await self._read_retry.call(
+            self._call_web_gateway, resource,
+            on_retry=lambda: self._metrics.inc('deconz_retries_total',
+                                               (('kind', 'read'),))))
+
+    async def _open_session(self):
+        """Create the pooled keep-alive session used for all REST calls."""
+        if not self._owns_session:
+            return
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self._limit_per_host,
+                keepalive_timeout=self._keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector)
+
+    async def _close_session(self):
+        """Close the pooled session and all of its connections."""
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method, url, data=None, resource=''):
+        """Send a request over the pooled session, return False on error."""
+        response = None
+        if self._metrics is not None:
+            start = asyncio.get_event_loop().time()
         try:
-            session = aiohttp.ClientSession()
-            with async_timeout.timeout(10):
-                action = session.put
-                response = yield from action(url, data=json_data)
-            if response.status != 200:
-                _LOGGER.error("DeConz Gateway returned http "
-                              "status %d, response %s.",
-                              response.status, (yield from response.text()))
+            # the session is opened by async_load and closed on stop
+            if self._session is None or self._session.closed:
+                _LOGGER.error("Session closed, not requesting %s.", url)
                 return False
-            result = yield from response.json()
+            async with async_timeout.timeout(10):
+                response = await self._session.request(method, url,
+                                                            data=data)
+                if response.status != 200:
+                    _LOGGER.error("DeConz Gateway returned http "
+                                  "status %d, response %s.",
+                                  response.status, (await response.text()))
+                    return False
+                result = await response.json(loads=self._codec.loads)
         except asyncio.TimeoutError:
             _LOGGER.error("Timeout getting DeConz data from %s.", url)
             return False
@@ -184,98 +389,459 @@ class DeCONZApi:
             _LOGGER.exception("Error getting DeConz data from %s.", url)
             return False
         finally:
-            if session:
-                yield from session.close()
-            if response:
-                yield from response.release()
+            if response is not None:
+                response.release()
+            if self._metrics is not None:
+                self._metrics.observe(
+                    'deconz_rest_seconds',
+                    (('resource', resource.split('/', 1)[0] or 'all'),
+                     ('method', method)),
+                    asyncio.get_event_loop().time() - start)
         return result
 
-    @retry(stop=stop_after_attempt(5),
-           wait=wait_fixed(3),
-           retry=retry_if_result(is_false))
-    @asyncio.coroutine
-    def _call_web_gateway(self, resource, use_get=True):
-        response = None
-        session = None
-        url = 'http://{a}:{b}/api/{c}/{d}'.format(a=self._host,
-                                                  b=self._port,
-                                                  c=self._api_key,
-                                                  d=resource)
+    async def async_resync(self, categories=None):
+        """Refetch sensors, lights and groups and apply the differences.
+
+        Only devices whose etag changed are updated, so update listeners
+        fire for the devices that actually changed. categories limits the
+        resync to some of them. Returns the number of added, changed or
+        removed devices.
+        """
+        if categories is None:
+            categories = DeCONZRegistry.CATEGORIES
+        results = await asyncio.gather(
+            *(self.get_data(category) for category in categories))
+        changed = 0
+        for category, items in zip(categories, results):
+            if items is False:
+                _LOGGER.warning("Resync of %s failed.", category)
+                continue
+            changed += await self._async_apply_category(category, items)
+        _LOGGER.debug("Resync changed %d devices.", changed)
+        return changed
+
+    async def _async_apply_category(self, category, items):
+        known = self._registry.category(category)
+        changed = 0
+        for dcz_id in set(known) - set(items):
+            self._registry.remove(category, dcz_id)
+            changed += 1
+        for dcz_id, data in items.items():
+            device = known.get(dcz_id)
+            if device is None:
+                await self._create_device(category, dcz_id, data)
+            elif device.etag is None or device.etag != data.get('etag'):
+                if await device.update(data):
+                    self._registry.reindex(category, device)
+                if category == 'groups':
+                    self._registry.update_group(device)
+            else:
+                continue
+            changed += 1
+        return changed
+
+    async def _async_revalidate(self):
+        await self._async_wait_for_websocket()
         try:
-            _LOGGER.debug("Attempting to retrieve DeConz data from %s.", url)
-            session = aiohttp.ClientSession()
-            with async_timeout.timeout(10):
-                action = session.get if use_get else session.put
-                response = yield from action(url)
-            if response.status != 200:
-                _LOGGER.error("DeConz Gateway returned http "
-                              "status %d, response %s.",
-                              response.status, (yield from response.text()))
-                return False
-            result = yield from response.json()
+            await self._async_load_all()
+        except ConnectionError as err:
+            _LOGGER.error("Revalidating the snapshot failed: %s", err)
+
+    async def _async_wait_for_websocket(self):
+        try:
+            await asyncio.wait_for(self._ws_ready.wait(),
+                                   self.WS_CONNECT_TIMEOUT)
         except asyncio.TimeoutError:
-            _LOGGER.error("Timeout getting DeConz data from %s.", url)
+            _LOGGER.warning("Websocket not connected, loading without it.")
+
+    async def _async_load_all(self):
+        categories = DeCONZRegistry.CATEGORIES
+        # every category finishes before a failure is raised, so none of
+        # them is left running
+        results = await asyncio.gather(
+            *(self._async_load_category(category)
+              for category in categories))
+        failed = [category for category, loaded in zip(categories, results)
+                  if not loaded]
+        if failed:
+            raise ConnectionError(
+                'Failed to load {}'.format(', '.join(failed)))
+        if self._snapshot_path is not None:
+            await self.async_save_snapshot()
+
+    async def _async_restore_snapshot(self):
+        loop = asyncio.get_event_loop()
+        snapshot = await loop.run_in_executor(None, read_snapshot,
+                                              self._snapshot_path,
+                                              self._codec)
+        if snapshot is None or snapshot.get('gateway') != self._gateway_id:
             return False
-        except aiohttp.ClientError:
-            _LOGGER.exception("Error getting DeConz data from %s.", url)
+        for category in DeCONZRegistry.CATEGORIES:
+            for dcz_id, data in snapshot.get(category, {}).items():
+                self._restore_device(category, dcz_id, data)
+        _LOGGER.debug("Restored %d devices from %s.", len(self._registry),
+                      self._snapshot_path)
+        return len(self._registry) > 0
+
+    @property
+    def _gateway_id(self):
+        return '{}:{}'.format(self._host, self._port)
+
+    async def _async_load_category(self, category):
+        """Load a category, return False if it could not be fetched.
+
+        Devices restored from a snapshot are kept if the fetch fails.
+        """
+        items = await self.get_data(category)
+        if items is False:
+            _LOGGER.error("Failed to load %s.", category)
+            if not self._registry.category(category):
+                del self._loading[category]
+                return False
+            items = {}
+        elif self._registry.category(category):
+            # restored from a snapshot, only apply what changed since
+            await self._async_apply_category(category, items)
+            items = {}
+        for count, (dcz_id, data) in enumerate(items.items(), 1):
+            await self._create_device(category, dcz_id, data)
+            if count % 100 == 0:
+                # let buffered events and other categories make progress
+                await asyncio.sleep(0)
+
+        # events arriving during the replay are buffered as well and
+        # replayed in the next round, so they are never reordered
+        buffered = self._loading[category]
+        while buffered:
+            self._loading[category] = []
+            for message in buffered:
+                if self._is_stale(message):
+                    _LOGGER.debug("Dropping event older than the loaded "
+                                  "state: %s", message)
+                    continue
+                await self._async_handle_message(message)
+            buffered = self._loading[category]
+        del self._loading[category]
+        return True
+
+    def _is_stale(self, message):
+        """Return True if a buffered change is contained in the loaded data.
+
+        The websocket delivers events in the order of the gateway, only
+        changes older than the loaded state are stale. lastupdated has a
+        resolution of one second, so a change in the same second is kept;
+        if it repeats the loaded state, change detection suppresses it.
+        Values that are not timestamps, like "none", are never stale.
+        """
+        if message.get('e') != 'changed':
             return False
-        finally:
-            if session:
-                yield from session.close()
-            if response:
-                yield from response.release()
+        device = self._registry.get(message.get('r'), message.get('id'))
+        known = getattr(device, 'lastupdated', None)
+        updated = message.get('state', {}).get('lastupdated')
+        return isinstance(known, str) and isinstance(updated, str) and \
+            _TIMESTAMP.match(known) is not None and \
+            _TIMESTAMP.match(updated) is not None and updated < known
+
+    async def _create_device(self, category, dcz_id, data):
+        """Build a device from its REST data and add it to the registry."""
+        if category == 'sensors':
+            device = DeCONZSensor(dcz_id,
+                                  name=data['name'],
+                                  device_type=data['type'],
+                                  keep_raw=self._keep_raw_payloads,
+                                  history=self._new_history())
+        else:
+            device = DeCONZLight(dcz_id,
+                                 name=data['name'],
+                                 device_type=data['type'],
+                                 state=data['state'],
+                                 api=self)
+        await device.update(data)
+        self._registry.add(category, device)
+        return device
+
+    def _restore_device(self, category, dcz_id, data):
+        """Build a device from its snapshot and add it to the registry."""
+        if category == 'sensors':
+            device = DeCONZSensor(dcz_id,
+                                  name=data.get('name'),
+                                  device_type=data['type'],
+                                  keep_raw=self._keep_raw_payloads,
+                                  history=self._new_history())
+        else:
+            device = DeCONZLight(dcz_id,
+                                 name=data.get('name'),
+                                 device_type=data['type'],
+                                 state={},
+                                 api=self)
+        device.restore(data)
+        self._registry.add(category, device)
+        return device
+
+    def _new_history(self):
+        if not self._history_size:
+            return None
+        return SensorHistory(self._history_size, self._history_retention)
+
+    async def _async_process_message(self, message):
+        if self._metrics is not None:
+            self._metrics.inc('deconz_ws_events_total',
+                              (('e', message.get('e')),
+                               ('r', message.get('r'))))
+
+        buffered = self._loading.get(message.get('r'))
+        if buffered is not None:
+            buffered.append(message)
+            return
+        await self._async_handle_message(message)
+
+    async def _async_handle_message(self, message):
+        handler = self._event_handlers.get(message.get('e'))
+        category = message.get('r')
+        if handler is None or category not in DeCONZRegistry.CATEGORIES:
+            _LOGGER.debug("Ignoring websocket message: %s", message)
+            return
+        await handler(category, message['id'], message)
+
+    async def _async_device_changed(self, category, dcz_id, message):
+        device = self._registry.get(category, dcz_id)
+        if device is None:
+            _LOGGER.warning("Change for unknown device %s/%s, ignoring.",
+                            category, dcz_id)
+            return
+        if self._metrics is None:
+            changed = await device.update(message)
+        else:
+            loop = asyncio.get_event_loop()
+            start = loop.time()
+            changed = await device.update(message)
+            # decoding and change detection of the event and the listeners
+            # it triggers
+            self._metrics.observe('deconz_event_apply_seconds',
+                                  (('r', category),), loop.time() - start)
+            if not changed:
+                self._metrics.inc('deconz_events_suppressed_total',
+                                  (('r', category),))
+        if changed:
+            self._registry.reindex(category, device)
+        if category == 'groups' and 'lights' in message:
+            self._registry.update_group(device)
+
+    async def _async_device_added(self, category, dcz_id, message):
+        # the event carries the new device as 'sensor', 'light' or 'group'
+        data = message.get(category[:-1])
+        if data is None:
+            data = await self.get_data('{}/{}'.format(category, dcz_id))
+            if data is False:
+                return
+        await self._create_device(category, dcz_id, data)
+
+    async def _async_device_deleted(self, category, dcz_id, message): #pylint: disable=unused-argument
+        self._registry.remove(category, dcz_id)
+
+    @staticmethod
+    def _light_payload(light):
+        data = {'on': light.is_on}
+        if light.transition_time is not None:
+            data['transitiontime'] = light.transition_time
+
+        if light.is_on: #turn on lights
+            dirty = light.dirty_fields
+
+            if 'bri' in dirty:
+                data['bri'] = light.brightness
+            for field, value in (('hue', light.hue), ('sat', light.sat),
+                                 ('ct', light.color_temp),
+                                 ('xy', light.xy_color)):
+                if field in dirty and value is not None:
+                    data['effect'] = 'none'
+                    data[field] = value
+            if 'effect' in dirty and light.effect is not None:
+                data['effect'] = light.effect
+                if light.colorloopspeed is not None:
+                    data['colorloopspeed'] = light.colorloopspeed
+            if 'alert' in dirty and light.alert is not None:
+                data.setdefault('effect', 'none')
+                data['alert'] = light.alert
+                if dirty == {'alert'}:
+                    del data['on']
+        return data
+
+    async def _set_state(self, resource, dcz_id, data):
+        action_string = 'action' if resource == 'groups' else 'state'
+        url = 'http://{host}:{port}/api/{api_key}/{resource}/{light_id}/{' \
+              'action}'.format(host=self._host, port=self._port,
+                               api_key=self._api_key, resource=resource,
+                               light_id=dcz_id, action=action_string)
+        json_data = self._codec.dumps(data)
+        return (await self._request('put', url, data=json_data,
+                                    resource=resource))
+
+    async def _call_web_gateway(self, resource, use_get=True):
+        url = 'http://{a}:{b}/api/{c}/{d}'.format(a=self._host,
+                                                  b=self._port,
+                                                  c=self._api_key,
+                                                  d=resource)
+        _LOGGER.debug("Attempting to retrieve DeConz data from %s.", url)
+        result = await self._request('get' if use_get else 'put', url,
+                                          resource=resource)
         _LOGGER.debug("Data from Deconz: %s", result)
         return result
 
-    @asyncio.coroutine
-    def _ws_read(self):
+    async def _ws_connect(self):
         import websockets as wslib
 
+        url = 'ws://{a}:{b}'.format(a=self._host, b=self._ws_port)
         try:
-            if not self._ws:
-                url = 'ws://{a}:{b}'.format(a=self._host, b=self._ws_port)
-                self._ws = yield from wslib.connect(url)
-                yield from self._ws.ping()
-                _LOGGER.info("Connected to websocket at %s.", url)
+            self._ws = await wslib.connect(
+                url, close_timeout=self.WS_CLOSE_TIMEOUT)
+            await self._ws.ping()
+            _LOGGER.info("Connected to websocket at %s.", url)
         except Exception as ws_exc:    # pylint: disable=broad-except
-            _LOGGER.error("Failed to connect to websocket: %s", ws_exc)
-            _LOGGER.error("Failed to connect to websocket: %s", url)
-            return
+            _LOGGER.error("Failed to connect to websocket at %s: %s",
+                          url, ws_exc)
+            self._ws = None
+            return False
+        return True
 
+    async def _ws_read(self):
         result = None
 
         try:
-            result = yield from self._ws.recv()
+            result = await self._ws.recv()
             _LOGGER.debug("Data from websocket: %s", result)
         except Exception as ws_exc:    # pylint: disable=broad-except
             _LOGGER.error("Failed to read from websocket: %s", ws_exc)
-            yield from self._ws_close()
+            await self._ws_close()
 
         return result
 
-    @asyncio.coroutine
-    def _ws_listen(self, async_callback):
+    async def _ws_listen(self, async_callback):
+        loop = asyncio.get_event_loop()
+        failures = 0
+        disconnected_at = None
         try:
             while True:
-                result = yield from self._ws_read()
+                if not self._ws:
+                    connected = await self._ws_connect()
+                    if self._ws_ready is not None:
+                        self._ws_ready.set()
+                    if not connected:
+                        if disconnected_at is None:
+                            disconnected_at = loop.time()
+                        self._start_polling()
+                        failures += 1
+                        delay = self._ws_reconnect.backoff(failures)
+                        _LOGGER.info("Trying again in %.2f seconds.", delay)
+                        await asyncio.sleep(delay)
+                        continue
+                    failures = 0
+                    if disconnected_at is not None:
+                        await self._stop_polling()
+                        self._ws_gap(loop.time() - disconnected_at)
+                        disconnected_at = None
+                        # events of the old connection are older than the
+                        # state fetched now, categories still being loaded
+                        # are fetched by async_load
+                        await self._dispatcher.drain()
+                        categories = [category for category in
+                                      DeCONZRegistry.CATEGORIES
+                                      if category not in self._loading]
+                        if categories:
+                            await self.async_resync(categories)
+
+                result = await self._ws_read()
 
                 if result:
+                    if self._recorder is not None:
+                        try:
+                            self._recorder.record(result)
+                        except OSError as err:
+                            _LOGGER.error("Failed to record frame: %s", err)
                     try:
-                        yield from async_callback(json.loads(result))
-                    except:    # pylint: disable=bare-except
+                        message = self._codec.loads(result)
+                        if self._skip_unsubscribed_events and \
+                                self._is_unsubscribed(message):
+                            continue
+                        await async_callback(message)
+                    except Exception:    # pylint: disable=broad-except
                         _LOGGER.exception("Exception in callback, ignoring.")
-                else:
-                    _LOGGER.info("Trying again in 30 seconds.")
-                    yield from asyncio.sleep(30)
+                elif not self._ws:
+                    disconnected_at = loop.time()
 
         finally:
-            yield from self._ws_close()
+            await self._stop_polling()
+            await self._ws_close()
+
+    def _start_polling(self):
+        if self._poll_interval is not None and self._poll_task is None:
+            _LOGGER.info("Websocket unavailable, polling devices.")
+            self._poll_task = asyncio.ensure_future(self._async_poll())
+
+    async def _stop_polling(self):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            await asyncio.wait([self._poll_task])
+            self._poll_task = None
+            _LOGGER.info("Websocket available, stopped polling.")
+
+    async def _async_poll(self):
+        """Resync the devices until cancelled.
+
+        Only devices whose etag changed are updated. The interval doubles
+        after every poll without changes and is reset by the first change.
+        """
+        interval = self._poll_interval
+        while True:
+            await asyncio.sleep(interval)
+            if self._loading:
+                # async_load is still fetching the devices
+                continue
+            try:
+                changed = await self.async_resync()
+            except Exception:    # pylint: disable=broad-except
+                _LOGGER.exception("Failed to poll devices.")
+                changed = 0
+            self._ws_stats['polls'] += 1
+            if self._metrics is not None:
+                self._metrics.inc('deconz_polls_total')
+            if changed:
+                interval = self._poll_interval
+            else:
+                interval = min(interval * 2, self._max_poll_interval)
+
+    def _is_unsubscribed(self, message):
+        """Return True for 'changed' events of devices nobody listens to.
+
+        The check runs on the decoded event: decoding a frame is cheaper
+        than picking the fields out of the raw text.
+        """
+        category = message.get('r')
+        if message.get('e') != 'changed' or category in self._loading:
+            return False
+        device = self._registry.get(category, message.get('id'))
+        if device is None or device.has_listeners:
+            return False
+        if self._metrics is not None:
+            self._metrics.inc('deconz_ws_events_skipped_total',
+                              (('r', category),))
+        return True
+
+    def _ws_gap(self, gap):
+        stats = self._ws_stats
+        stats['reconnects'] += 1
+        stats['last_gap'] = gap
+        stats['max_gap'] = max(stats['max_gap'], gap)
+        stats['total_gap'] += gap
+        if self._metrics is not None:
+            self._metrics.inc('deconz_ws_reconnects_total')
+            self._metrics.observe('deconz_ws_gap_seconds', (), gap)
+        _LOGGER.info("Websocket reconnected after %.2f seconds.", gap)
 
-    @asyncio.coroutine
-    def _ws_close(self):
+    async def _ws_close(self):
         try:
             if self._ws:
-                yield from self._ws.close()
+                await self._ws.close()
         except Exception as ws_exc:    # pylint: disable=broad-except
             _LOGGER.error("Exception during websocket close: %s", ws_exc)
         finally:
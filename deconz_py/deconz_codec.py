@@ -0,0 +1,35 @@
+"""Module to encode and decode deCONZ JSON payloads"""
+
+import json
+from collections import namedtuple
+
+JSONCodec = namedtuple('JSONCodec', ['name', 'loads', 'dumps'])
+
+def _orjson():
+    import orjson
+    return JSONCodec('orjson', orjson.loads,
+                     lambda obj: orjson.dumps(obj).decode())
+
+def _ujson():
+    import ujson
+    return JSONCodec('ujson', ujson.loads, ujson.dumps)
+
+def _stdlib():
+    return JSONCodec('json', json.loads, json.dumps)
+
+_CODECS = {'orjson': _orjson, 'ujson': _ujson, 'json': _stdlib}
+
+def get_codec(name=None):
+    """Return the codec with the given name.
+
+    Without a name the fastest available one is returned, orjson, then
+    ujson and the standard library json module as fallback.
+    """
+    if name is not None:
+        return _CODECS[name]()
+    for factory in (_orjson, _ujson):
+        try:
+            return factory()
+        except ImportError:
+            pass
+    return _stdlib()
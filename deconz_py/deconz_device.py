@@ -0,0 +1,171 @@
+"""Module with the common base of deCONZ sensors and lights"""
+
+import logging
+import asyncio
+import sys
+
+_LOGGER = logging.getLogger(__name__)
+
+def updated_attributes(data):
+    """Return the names of all attributes an update touches.
+
+    These are the top level keys of the update and the keys inside its
+    'state' and 'config' dicts.
+    """
+    attributes = set(data)
+    for section in ('state', 'config'):
+        if isinstance(data.get(section), dict):
+            attributes.update(data[section])
+    return attributes
+
+def intern(value):
+    """Intern strings repeated across many devices, like types and models."""
+    return sys.intern(value) if isinstance(value, str) else value
+
+class _UpdateListener:
+    """A registered update listener."""
+
+    __slots__ = ('callback', 'attributes', 'timeout', 'with_changes')
+
+    def __init__(self, callback, attributes, timeout, with_changes):
+        self.callback = callback
+        self.attributes = frozenset(attributes) if attributes else None
+        self.timeout = timeout
+        self.with_changes = with_changes
+
+class DeCONZDevice:
+    """Base class of all deCONZ devices handling the update listeners."""
+
+    __slots__ = ('_dcz_id', '_name', '_device_type', '_etag', '_uniqueid',
+                 '_update_listeners')
+
+    LISTENER_TIMEOUT = 10.0
+
+    # attributes saved in snapshots, stored in the slot of the same name
+    # with a leading underscore
+    SNAPSHOT_FIELDS = ('name', 'etag', 'uniqueid')
+
+    def __init__(self, dcz_id, name, device_type):
+        """Initialize the device."""
+        self._dcz_id = dcz_id
+        self._name = name
+        self._device_type = intern(device_type)
+        self._etag = None
+        self._uniqueid = None
+        # replaced on every change, so notifying never needs a copy
+        self._update_listeners = ()
+
+    @property
+    def dcz_id(self):
+        """Return the deconz id"""
+        return self._dcz_id
+
+    @property
+    def name(self):
+        """The name of the device."""
+        return self._name
+
+    @property
+    def device_type(self):
+        """The device type."""
+        return self._device_type
+
+    @property
+    def etag(self):
+        """The etag of the device."""
+        return self._etag
+
+    @property
+    def uniqueid(self):
+        """The uniqueid of the device."""
+        return self._uniqueid
+
+    @property
+    def has_listeners(self):
+        """Return True if any update listener is registered."""
+        return bool(self._update_listeners)
+
+    def snapshot(self):
+        """Return the normalised attributes of the device as a dict."""
+        data = {'type': self._device_type}
+        for field in self.SNAPSHOT_FIELDS:
+            value = getattr(self, '_' + field)
+            if value is not None:
+                data[field] = value
+        return data
+
+    def restore(self, data):
+        """Set the attributes of a snapshot, listeners are not notified."""
+        for field in self.SNAPSHOT_FIELDS:
+            if field in data:
+                setattr(self, '_' + field, data[field])
+
+    def add_update_listener(self, update_listener, attributes=None,
+                            timeout=None, with_changes=False):
+        """update_listener is called as soon as the device receives an update
+
+        The listener may be a coroutine function or a plain callable. If
+        attributes is given it is only called for updates changing one of
+        them, a coroutine is cancelled after timeout seconds. With
+        with_changes it is called with the update and the set of changed
+        attributes.
+        """
+        self._update_listeners += (_UpdateListener(
+            update_listener, attributes,
+            self.LISTENER_TIMEOUT if timeout is None else timeout,
+            with_changes),)
+
+    def remove_update_listener(self, update_listener):
+        """remove an update_listener"""
+        listeners = self._update_listeners
+        for index, listener in enumerate(listeners):
+            if listener.callback == update_listener:
+                self._update_listeners = listeners[:index] + \
+                                         listeners[index + 1:]
+                return
+        raise ValueError('Listener not registered')
+
+    def _set_field(self, name, attribute, value, changed):
+        """Set an attribute, add name to changed if the value differs."""
+        if getattr(self, attribute) != value:
+            setattr(self, attribute, value)
+            changed.add(name)
+
+    async def _notify_listeners(self, data, changed=None):
+        """Call all interested listeners, coroutines run concurrently.
+
+        changed is the set of attributes the update changed, by default
+        all attributes it touches.
+        """
+        if changed is not None:
+            changed = frozenset(changed)
+        pending = []
+        for listener in self._update_listeners:
+            if changed is None and (listener.attributes is not None or
+                                    listener.with_changes):
+                changed = updated_attributes(data)
+            if listener.attributes is not None and \
+                    listener.attributes.isdisjoint(changed):
+                continue
+            try:
+                if listener.with_changes:
+                    result = listener.callback(data, changed)
+                else:
+                    result = listener.callback(data)
+            except Exception:    # pylint: disable=broad-except
+                _LOGGER.exception("Exception in update listener, ignoring.")
+                continue
+            if asyncio.iscoroutine(result) or asyncio.isfuture(result):
+                pending.append(self._await_listener(listener, result))
+        if pending:
+            await asyncio.gather(*pending)
+
+    @staticmethod
+    async def _await_listener(listener, result):
+        try:
+            await asyncio.wait_for(result, listener.timeout)
+        except asyncio.TimeoutError:
+            _LOGGER.warning("Update listener %s timed out after %.1fs.",
+                            listener.callback, listener.timeout)
+        except Exception:    # pylint: disable=broad-except
+            _LOGGER.exception("Exception in update listener, ignoring.")
@@ -0,0 +1,143 @@
+"""Module to dispatch deCONZ websocket events"""
+
+import logging
+import asyncio
+from collections import OrderedDict, deque
+
+_LOGGER = logging.getLogger(__name__)
+
+def event_key(event):
+    """Return the device an event belongs to."""
+    return (event.get('r'), event.get('id'))
+
+class DeCONZDispatcher:
+    """Bounded event queue between the websocket reader and the devices.
+
+    Events are queued per device and handed to a pool of workers. A worker
+    takes all queued events of one device, so events for the same device
+    are processed in order while different devices run in parallel.
+
+    When `maxsize` events are queued, `put` either waits for free space
+    (BLOCK) or drops the oldest queued event of the same device, or of the
+    device queued first if this one has none (DROP_OLDEST).
+    """
+
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+
+    def __init__(self, callback, workers=4, maxsize=1000, overflow=BLOCK, #pylint: disable=too-many-arguments
+                 metrics=None):
+        """Initialize the dispatcher.
+
+        callback is the coroutine function every event is passed to. The
+        dispatch lag and dropped events are recorded in metrics if a
+        DeCONZMetrics instance is given.
+        """
+        if overflow not in (self.BLOCK, self.DROP_OLDEST):
+            raise ValueError('Overflow policy not supported')
+        self._callback = callback
+        self._workers = workers
+        self._maxsize = maxsize
+        self._overflow = overflow
+        self._metrics = metrics
+        self._pending = OrderedDict()
+        self._size = 0
+        self._ready = None
+        self._space = None
+        self._idle = None
+        self._tasks = []
+        self._lag = 0.0
+        self._max_lag = 0.0
+        self._dropped = 0
+
+    @property
+    def depth(self):
+        """Return the number of queued events."""
+        return self._size
+
+    @property
+    def stats(self):
+        """Return queue depth, dispatch lag in seconds and dropped events."""
+        return {'depth': self._size, 'lag': self._lag,
+                'max_lag': self._max_lag, 'dropped': self._dropped}
+
+    def start(self):
+        """Start the dispatch workers."""
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._space = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.ensure_future(self._work())
+                       for _ in range(self._workers)]
+
+    async def stop(self):
+        """Stop the dispatch workers and drop all queued events."""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+        self._pending.clear()
+        self._size = 0
+        if self._idle is not None:
+            self._idle.set()
+
+    async def drain(self):
+        """Wait until all queued events are processed."""
+        if self._tasks:
+            await self._idle.wait()
+
+    async def put(self, event):
+        """Queue an event, waiting for space if the queue is full."""
+        key = event_key(event)
+        if self._size >= self._maxsize:
+            if self._overflow == self.BLOCK:
+                while self._size >= self._maxsize:
+                    self._space.clear()
+                    await self._space.wait()
+            else:
+                self._drop_oldest(key)
+
+        events = self._pending.get(key)
+        if events is None:
+            events = self._pending[key] = deque()
+            self._ready.put_nowait(key)
+            self._idle.clear()
+        events.append((asyncio.get_event_loop().time(), event))
+        self._size += 1
+
+    def _drop_oldest(self, key):
+        events = self._pending.get(key)
+        if not events:
+            events = next((queued for queued in self._pending.values()
+                           if queued), None)
+        if events:
+            events.popleft()
+            self._size -= 1
+            self._dropped += 1
+            if self._metrics is not None:
+                self._metrics.inc('deconz_events_dropped_total')
+
+    async def _work(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            key = await self._ready.get()
+            events = self._pending[key]
+            while events:
+                enqueued, event = events.popleft()
+                self._size -= 1
+                self._space.set()
+                self._lag = loop.time() - enqueued
+                self._max_lag = max(self._max_lag, self._lag)
+                if self._metrics is not None:
+                    self._metrics.observe('deconz_dispatch_lag_seconds', (),
+                                          self._lag)
+                try:
+                    await self._callback(event)
+                except Exception:    # pylint: disable=broad-except
+                    _LOGGER.exception("Exception in callback, ignoring.")
+            del self._pending[key]
+            if not self._pending:
+                self._idle.set()
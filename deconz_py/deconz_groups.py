@@ -0,0 +1,25 @@
+"""Module to plan light commands using deCONZ groups"""
+
+def plan_commands(light_ids, groups):
+    """Return the group and light ids that cover exactly light_ids.
+
+    groups maps group ids to the set of their member light ids. Only groups
+    whose members are all part of light_ids are used, so no other light is
+    touched. Groups are picked greedily by the number of lights they newly
+    cover, a group has to cover at least two new lights to beat single
+    commands. Returns (group_ids, light_ids) with the remaining lights.
+    """
+    remaining = set(light_ids)
+    candidates = [(group_id, members) for group_id, members in groups.items()
+                  if len(members) > 1 and members <= remaining]
+    chosen = []
+    while candidates:
+        group_id, members = max(candidates,
+                                key=lambda item: len(item[1] & remaining))
+        if len(members & remaining) < 2:
+            break
+        chosen.append(group_id)
+        remaining -= members
+        candidates = [(other_id, other) for other_id, other in candidates
+                      if other_id != group_id and len(other & remaining) > 1]
+    return chosen, sorted(remaining)
@@ -0,0 +1,160 @@
+"""Module to keep the recent readings of a sensor"""
+
+import itertools
+import math
+import time
+from array import array
+
+class SensorHistory:
+    """Fixed size ring buffer of the numeric readings of a sensor.
+
+    Timestamps and values are kept in two preallocated arrays of doubles,
+    so a buffer takes 16 bytes per reading however long it runs. Once it is
+    full the oldest reading is overwritten. Readings older than retention
+    seconds are left out of all queries.
+    """
+
+    __slots__ = ('_timestamps', '_values', '_capacity', '_retention',
+                 '_head', '_count')
+
+    def __init__(self, capacity=360, retention=None):
+        """Initialize an empty buffer for capacity readings."""
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        self._timestamps = array('d', bytes(8 * capacity))
+        self._values = array('d', bytes(8 * capacity))
+        self._capacity = capacity
+        self._retention = retention
+        # index the next reading is written to
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self):
+        """Return the maximum number of readings kept."""
+        return self._capacity
+
+    @property
+    def retention(self):
+        """Return the number of seconds readings are kept or None."""
+        return self._retention
+
+    def append(self, value, timestamp=None):
+        """Add a reading taken at timestamp, by default now.
+
+        Values that are not numbers, like "unknown", are ignored. Returns
+        True if the reading was added.
+        """
+        if not isinstance(value, (int, float)):
+            return False
+        head = self._head
+        self._timestamps[head] = time.time() if timestamp is None \
+            else timestamp
+        self._values[head] = value
+        self._head = (head + 1) % self._capacity
+        if self._count < self._capacity:
+            self._count += 1
+        return True
+
+    def export(self, window=None, now=None):
+        """Return the timestamps and values as two arrays, oldest first.
+
+        With window only the readings of the last window seconds before
+        now (by default the current time) are returned.
+        """
+        timestamps = array('d')
+        values = array('d')
+        for begin, end in self._segments(window, now):
+            timestamps.extend(self._timestamps[begin:end])
+            values.extend(self._values[begin:end])
+        return timestamps, values
+
+    def aggregate(self, window=None, now=None):
+        """Return count, min, max and mean of the last window seconds.
+
+        min, max and mean are None if there is no reading in the window.
+        """
+        view = memoryview(self._values)
+        segments = [view[begin:end]
+                    for begin, end in self._segments(window, now)]
+        count = sum(len(segment) for segment in segments)
+        if not count:
+            return {'count': 0, 'min': None, 'max': None, 'mean': None}
+        return {'count': count,
+                'min': min(min(segment) for segment in segments),
+                'max': max(max(segment) for segment in segments),
+                'mean': math.fsum(itertools.chain(*segments)) / count}
+
+    def downsample(self, interval, window=None, now=None):
+        """Return count, min, max and mean per interval seconds, oldest first.
+
+        The readings of the last window seconds are put in buckets aligned
+        to multiples of interval, 'start' is the start of a bucket. Buckets
+        without readings are left out.
+        """
+        if interval <= 0:
+            raise ValueError('interval must be positive')
+        buckets = []
+        bucket = None
+        timestamps = self._timestamps
+        values = self._values
+        for begin, end in self._segments(window, now):
+            for index in range(begin, end):
+                value = values[index]
+                start = math.floor(timestamps[index] / interval) * interval
+                if bucket is None or bucket['start'] != start:
+                    if bucket is not None:
+                        bucket['mean'] = bucket.pop('sum') / bucket['count']
+                    bucket = {'start': start, 'count': 0, 'min': value,
+                              'max': value, 'sum': 0.0}
+                    buckets.append(bucket)
+                bucket['count'] += 1
+                bucket['sum'] += value
+                if value < bucket['min']:
+                    bucket['min'] = value
+                elif value > bucket['max']:
+                    bucket['max'] = value
+        if bucket is not None:
+            bucket['mean'] = bucket.pop('sum') / bucket['count']
+        return buckets
+
+    def _segments(self, window, now):
+        """Return the (begin, end) index ranges of the readings in the window.
+
+        The readings are ordered oldest first across at most two ranges of
+        the ring buffer, none of them is copied.
+        """
+        count = self._count
+        first = self._head if count == self._capacity else 0
+        skip = 0
+        spans = [span for span in (window, self._retention)
+                 if span is not None]
+        if spans and count:
+            cutoff = (time.time() if now is None else now) - min(spans)
+            # binary search over the readings in age order
+            low, high = 0, count
+            capacity = self._capacity
+            timestamps = self._timestamps
+            while low < high:
+                middle = (low + high) // 2
+                if timestamps[(first + middle) % capacity] < cutoff:
+                    low = middle + 1
+                else:
+                    high = middle
+            skip = low
+        begin = (first + skip) % self._capacity
+        remaining = count - skip
+        if not remaining:
+            return []
+        if begin + remaining <= self._capacity:
+            return [(begin, begin + remaining)]
+        return [(begin, self._capacity),
+                (0, begin + remaining - self._capacity)]
+
+    def clear(self):
+        """Remove all readings."""
+        self._head = 0
+        self._count = 0
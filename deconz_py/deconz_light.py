@@ -1,8 +1,32 @@
 """Module to represent a deCONZ Light"""
 
-import asyncio
-
-class DeCONZLight:
+from .deconz_device import DeCONZDevice, intern
+from .deconz_scheduler import DeCONZScheduler
+
+# state keys of the deCONZ API and the attributes holding their values
+_STATE_ATTRIBUTES = {'on': '_current_state', 'bri': '_dimmer',
+                     'ct': '_ct_color', 'xy': '_xy_color', 'hue': '_hue',
+                     'sat': '_sat', 'alert': '_alert', 'effect': '_effect'}
+
+def parse_result(result):
+    """Return the sets of state keys confirmed and rejected by a PUT.
+
+    deCONZ answers with one entry per attribute, either
+    {'success': {'/lights/1/state/bri': 100}} or
+    {'error': {'address': '/lights/1/state/bri', ...}}. An error that does
+    not name an attribute is returned as None in the rejected set.
+    """
+    succeeded, failed = set(), set()
+    for item in result:
+        if 'success' in item:
+            for address in item['success']:
+                succeeded.add(address.rsplit('/', 1)[-1])
+        elif 'error' in item:
+            key = item['error'].get('address', '').rsplit('/', 1)[-1]
+            failed.add(key if key in _STATE_ATTRIBUTES else None)
+    return succeeded, failed
+
+class DeCONZLight(DeCONZDevice):
     """The platform class required by Home Asisstant."""
 
     COLOR_TEMPERATURE_LIGHT = 'Color temperature light'
@@ -10,12 +34,22 @@ class DeCONZLight:
     EXTENDED_COLOR_LIGHT = 'Extended color light'
     LIGHT_GROUP = 'LightGroup'
 
+    __slots__ = ('_api', '_is_group', '_current_state', '_dimmer',
+                 '_ct_color', '_xy_color', '_hue', '_sat', '_reachable',
+                 '_transition_time', '_alert', '_effect', '_colorloopspeed',
+                 '_colormode', '_lights', '_dirty', '_generation',
+                 '_on_generation', '_confirmed', '_sending',
+                 '_manufacturername',
+                 '_modelid')
+
+    SNAPSHOT_FIELDS = DeCONZDevice.SNAPSHOT_FIELDS + (
+        'current_state', 'dimmer', 'ct_color', 'xy_color', 'hue', 'sat',
+        'reachable', 'alert', 'effect', 'colorloopspeed', 'colormode',
+        'lights', 'manufacturername', 'modelid')
+
     def __init__(self, dcz_id, name, state, device_type, api): #pylint: disable=too-many-arguments
         """Initialize a Light."""
-
-        self._dcz_id = dcz_id
-        self._name = name
-        self._device_type = device_type
+        super().__init__(dcz_id, name, device_type)
         self._api = api
 
         self._is_group = self._device_type == self.LIGHT_GROUP
@@ -27,27 +61,75 @@ class DeCONZLight:
         self._xy_color = None
         self._hue = None
         self._sat = None
-        self._reachable = False
+        # groups have no reachable state of their own
+        self._reachable = None if self._is_group else False
         self._transition_time = None
         self._alert = None
         self._effect = None
         self._colorloopspeed = None
         self._colormode = None
-        
-        self._update = None
+        self._lights = ()
+        self._manufacturername = None
+        self._modelid = None
+
+        # attributes changed locally and not yet confirmed by the gateway,
+        # mapped to the generation they were last changed in
+        self._dirty = {}
+        self._generation = 0
+        self._on_generation = 0
+        # last values confirmed by the gateway for attributes that were
+        # changed optimistically, restored if the change is rejected
+        self._confirmed = {}
+        # attributes of commands on their way -> number of those commands
+        self._sending = {}
 
         self.parse_state(state)
 
-        self._update_listeners = []
+    async def update(self, data):
+        """Update the state of the device.
 
-    @asyncio.coroutine
-    def update(self, data):
-        """Update the state of the device."""
+        Returns the set of attributes that changed. Listeners are only
+        notified if there is one, a new etag alone is no change.
+        """
+        changed = set()
         if 'state' in data:
-            self.parse_state(data['state'])
-
-        for update_listener in self._update_listeners:
-            yield from update_listener(data)
+            changed.update(self.parse_state(data['state']))
+        if 'name' in data:
+            self._set_field('name', '_name', data['name'], changed)
+        if 'etag' in data:
+            self._etag = data['etag']
+        if 'uniqueid' in data:
+            self._set_field('uniqueid', '_uniqueid', data['uniqueid'], changed)
+        if 'lights' in data:
+            self._set_field('lights', '_lights', tuple(data['lights']),
+                            changed)
+        for field in ('manufacturername', 'modelid'):
+            if field in data:
+                self._set_field(field, '_' + field, intern(data[field]),
+                                changed)
+
+        if changed:
+            await self._notify_listeners(data, changed)
+        return changed
+
+    def snapshot(self):
+        """Return the confirmed attributes of the light as a dict."""
+        data = super().snapshot()
+        for key, value in self._confirmed.items():
+            field = _STATE_ATTRIBUTES[key][1:]
+            if value is None:
+                data.pop(field, None)
+            else:
+                data[field] = value
+        return data
+
+    def restore(self, data):
+        """Set the attributes of a snapshot, listeners are not notified."""
+        super().restore(data)
+        self._lights = tuple(self._lights)
+        for field in ('alert', 'effect', 'colormode', 'manufacturername',
+                      'modelid'):
+            setattr(self, '_' + field, intern(getattr(self, '_' + field)))
 
     @property
     def xy_color(self):
@@ -56,8 +138,7 @@ class DeCONZLight:
 
     @xy_color.setter
     def xy_color(self, value):
-        self._update = 'xy'
-        self._xy_color = value
+        self._mark_dirty('xy', value)
 
     @property
     def color_temp(self):
@@ -66,8 +147,7 @@ class DeCONZLight:
 
     @color_temp.setter
     def color_temp(self, value):
-        self._update = 'ct'
-        self._ct_color = value
+        self._mark_dirty('ct', value)
 
     @property
     def hue(self):
@@ -76,8 +156,7 @@ class DeCONZLight:
 
     @hue.setter
     def hue(self, value):
-        self._update = 'hs'
-        self._hue = value
+        self._mark_dirty('hue', value)
 
     @property
     def sat(self):
@@ -86,18 +165,7 @@ class DeCONZLight:
 
     @sat.setter
     def sat(self, value):
-        self._update = 'hs'
-        self._sat = value
-
-    @property
-    def dcz_id(self):
-        """Return the deconz id"""
-        return self._dcz_id
-
-    @property
-    def name(self):
-        """Return the display name of this light."""
-        return self._name
+        self._mark_dirty('sat', value)
 
     @property
     def brightness(self):
@@ -106,23 +174,37 @@ class DeCONZLight:
 
     @brightness.setter
     def brightness(self, value):
-        self._update = 'bri'
-        self._dimmer = value
+        self._mark_dirty('bri', value)
 
     @property
     def is_group(self):
         """Return the is_group of the light."""
         return self._is_group
 
+    @property
+    def lights(self):
+        """Return the ids of the member lights of a group."""
+        return self._lights
+
     @property
     def is_on(self):
         """Return true if light is on."""
         return self._current_state
 
     @property
-    def device_type(self):
-        """The device type."""
-        return self._device_type
+    def reachable(self):
+        """Return true if the light is reachable, None for groups."""
+        return self._reachable
+
+    @property
+    def manufacturername(self):
+        """The manufacturername of the light."""
+        return self._manufacturername
+
+    @property
+    def modelid(self):
+        """The modelid of the light."""
+        return self._modelid
 
     @property
     def transition_time(self):
@@ -140,8 +222,7 @@ class DeCONZLight:
 
     @alert.setter
     def alert(self, value):
-        self._update = 'alert'
-        self._alert = value
+        self._mark_dirty('alert', value)
 
     @property
     def effect(self):
@@ -150,8 +231,7 @@ class DeCONZLight:
 
     @effect.setter
     def effect(self, value):
-        self._update = 'effect'
-        self._effect = value
+        self._mark_dirty('effect', value)
 
     @property
     def colorloopspeed(self):
@@ -172,10 +252,10 @@ class DeCONZLight:
         self._colormode = value
 
     @property
-    def refresh(self):
-        """Return the flash state of the light."""
-        return self._update
-     
+    def dirty_fields(self):
+        """Return the attributes changed since the last confirmed command."""
+        return set(self._dirty)
+
     @property
     def effect_list(self):
         """Return the list of supported effects."""
@@ -183,48 +263,139 @@ class DeCONZLight:
             return ['colorloop']
         return None
 
-    @asyncio.coroutine
-    def turn_off(self):
+    @property
+    def pending_fields(self):
+        """Return the attributes changed optimistically and not confirmed."""
+        return set(self._confirmed)
+
+    async def turn_off(self, priority=DeCONZScheduler.INTERACTIVE):
         """Instruct the light to turn off."""
-        self._current_state = False
-        yield from self._api.set_light(self)
+        changed = self._set_on(False)
+        return await self._send_state(priority, changed)
 
-    @asyncio.coroutine
-    def turn_on(self):
+    async def turn_on(self, priority=DeCONZScheduler.INTERACTIVE):
         """Instruct the light to turn on."""
-        self._current_state = True
-        yield from self._api.set_light(self)
+        changed = self._set_on(True)
+        return await self._send_state(priority, changed)
+
+    def _set_on(self, value):
+        """Set the on state, return True if it changed."""
+        self._confirmed.setdefault('on', self._current_state)
+        self._generation += 1
+        self._on_generation = self._generation
+        changed = value != self._current_state
+        self._current_state = value
+        return changed
+
+    async def _send_state(self, priority, on_changed):
+        """Send the state optimistically and roll back rejected attributes.
+
+        Listeners see the changed attributes before the gateway answers,
+        'on' only if on_changed. Attributes the gateway rejects, or all of
+        them if the command fails, are reset to the last confirmed values
+        and listeners are notified again.
+        """
+        # attributes are only part of the payload while the light is on
+        sent = dict(self._dirty) if self._current_state else {}
+        sent['on'] = self._on_generation
+        values = self._state_of(sent)
+        for key in sent:
+            self._sending[key] = self._sending.get(key, 0) + 1
+        try:
+            future = self._api.set_light(self, priority)
+            # dirty attributes always differ from what listeners last saw
+            shown = {key: value for key, value in values.items()
+                     if key != 'on' or on_changed}
+            if shown:
+                await self._notify_listeners({'state': shown}, shown.keys())
+            try:
+                result = await future
+            except Exception: #pylint: disable=broad-except
+                result = False
+        finally:
+            for key in sent:
+                count = self._sending.pop(key) - 1
+                if count:
+                    self._sending[key] = count
+
+        if result is False:
+            succeeded, failed = set(), {None}
+        else:
+            succeeded, failed = parse_result(result)
+        if None in failed:
+            failed = set(sent)
+
+        rolled_back = {}
+        for key, generation in sent.items():
+            newer = self._changed_in(key) > generation
+            if key in failed:
+                if newer:
+                    # the newer change is on its way and may still succeed
+                    continue
+                self._dirty.pop(key, None)
+                if key in self._confirmed:
+                    value = self._confirmed.pop(key)
+                    setattr(self, _STATE_ATTRIBUTES[key], value)
+                    rolled_back[key] = value
+            elif key in succeeded or key == 'on':
+                # 'on' is left out of alert only commands
+                if newer:
+                    self._confirmed[key] = values[key]
+                else:
+                    self._dirty.pop(key, None)
+                    self._confirmed.pop(key, None)
+        if rolled_back:
+            await self._notify_listeners({'state': rolled_back},
+                                         rolled_back.keys())
+        return result
+
+    def _changed_in(self, key):
+        if key == 'on':
+            return self._on_generation
+        return self._dirty.get(key, 0)
+
+    def _state_of(self, keys):
+        return {key: getattr(self, _STATE_ATTRIBUTES[key]) for key in keys}
+
+    def _mark_dirty(self, field, value):
+        attribute = _STATE_ATTRIBUTES[field]
+        current = getattr(self, attribute)
+        # an alert is an action, repeating it makes the light blink again
+        if value == current and field != 'alert':
+            return
+        self._confirmed.setdefault(field, current)
+        self._generation += 1
+        self._dirty[field] = self._generation
+        setattr(self, attribute, value)
 
     def parse_state(self, state):
+        """Apply a state reported by the gateway, return the changed keys.
+
+        Attributes sent with a command that is still on its way keep their
+        local value, the reported one becomes the value to roll back to.
+        Local changes not sent yet are replaced by the reported value.
+        """
+        if 'on' not in state and 'any_on' in state:
+            state = dict(state, on=state['any_on'])
+
+        changed = set()
+        for key, attribute in _STATE_ATTRIBUTES.items():
+            if key not in state:
+                continue
+            value = state[key]
+            if key in ('alert', 'effect'):
+                value = intern(value)
+            if key in self._sending:
+                self._confirmed[key] = value
+            else:
+                self._dirty.pop(key, None)
+                self._confirmed.pop(key, None)
+                self._set_field(key, attribute, value, changed)
 
-        if 'on' in state:
-            self._current_state = state['on']
-        elif 'any_on' in state:
-            self._current_state = state['any_on']
-
-        if 'bri' in state:
-            self._dimmer = state['bri']
-        if 'ct' in state:
-            self._ct_color = state['ct']
-        if 'xy' in state:
-            self._xy_color = state['xy']
-        if 'hue' in state:
-            self._hue = state['hue']
-        if 'sat' in state:
-            self._sat = state['sat']
-        if 'alert' in state:
-            self._alert = state['alert']
         if 'colormode' in state:
-            self._colormode = state['colormode']
-        if 'effect' in state:
-            self._effect = state['effect'] 
+            self._set_field('colormode', '_colormode',
+                            intern(state['colormode']), changed)
         if 'reachable' in state:
-            self._reachable = state['reachable']
-
-    def add_update_listener(self, update_listener):
-        """update_listener is called as soon as the sensor receives an update"""
-        self._update_listeners.append(update_listener)
-
-    def remove_update_listener(self, update_listener):
-        """remove an update_listener"""
-        self._update_listeners.remove(update_listener)
+            self._set_field('reachable', '_reachable', state['reachable'],
+                            changed)
+        return changed
@@ -0,0 +1,123 @@
+"""Module to run several deCONZ gateways side by side"""
+
+import logging
+import asyncio
+
+import aiohttp
+
+from .deconz_api import DeCONZApi
+from .deconz_registry import DeCONZRegistry
+
+_LOGGER = logging.getLogger(__name__)
+
+class DeCONZManager:
+    """Run several gateways on one event loop with one connection pool.
+
+    Every gateway is a DeCONZApi registered under a name. All of them share
+    one aiohttp session, so connections are pooled across gateways, and
+    each one is started and stopped on its own without touching tasks it
+    did not create.
+    """
+
+    def __init__(self, limit=100, limit_per_host=4, keepalive_timeout=30):
+        """Initialize the manager.
+
+        limit caps the connections of the shared pool, limit_per_host the
+        connections to a single gateway.
+        """
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._keepalive_timeout = keepalive_timeout
+        self._session = None
+        self._gateways = {}
+        self._started = set()
+
+    @property
+    def gateways(self):
+        """Return the dict of all gateways keyed by name."""
+        return self._gateways
+
+    def get_gateway(self, name):
+        """Return the gateway registered under name."""
+        return self._gateways[name]
+
+    async def async_add_gateway(self, name, host, port, ws_port, api_key, #pylint: disable=too-many-arguments
+                                **options):
+        """Register a gateway, options are passed on to DeCONZApi."""
+        if name in self._gateways:
+            raise ValueError('Gateway {} already registered'.format(name))
+        self._open_session()
+        api = DeCONZApi(host, port, ws_port, api_key, session=self._session,
+                        **options)
+        self._gateways[name] = api
+        return api
+
+    def _open_session(self):
+        """Create the shared session and hand it to all gateways."""
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self._limit, limit_per_host=self._limit_per_host,
+            keepalive_timeout=self._keepalive_timeout)
+        self._session = aiohttp.ClientSession(connector=connector)
+        for api in self._gateways.values():
+            api.session = self._session
+
+    async def async_remove_gateway(self, name):
+        """Stop a gateway and forget it."""
+        await self.async_stop_gateway(name)
+        del self._gateways[name]
+
+    async def async_start_gateway(self, name):
+        """Load the devices of a gateway and subscribe to its events."""
+        if name in self._started:
+            return
+        self._open_session()
+        await self._gateways[name].async_load()
+        self._started.add(name)
+
+    async def async_stop_gateway(self, name):
+        """Stop the websocket listener of a gateway and clear its devices."""
+        if name not in self._started:
+            return
+        self._started.discard(name)
+        await self._gateways[name].async_stop()
+
+    async def async_start(self):
+        """Start all gateways concurrently."""
+        names = list(self._gateways)
+        results = await asyncio.gather(
+            *(self.async_start_gateway(name) for name in names),
+            return_exceptions=True)
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                _LOGGER.error("Failed to start gateway %s: %s", name, result)
+
+    async def async_stop(self):
+        """Stop all gateways and close the shared connection pool."""
+        await asyncio.gather(
+            *(self.async_stop_gateway(name) for name in list(self._started)))
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def get_device(self, name, category, dcz_id):
+        """Return a device of a gateway or None if it is not known."""
+        gateway = self._gateways.get(name)
+        if gateway is None:
+            return None
+        return gateway.get_devices(category).get(dcz_id)
+
+    def get_devices(self, category=None):
+        """Return the devices of all gateways keyed by (name, id).
+
+        Without category the key is (name, category, id).
+        """
+        if category is not None:
+            return {(name, dcz_id): device
+                    for name, gateway in self._gateways.items()
+                    for dcz_id, device in gateway.get_devices(category).items()}
+        return {(name, category, dcz_id): device
+                for name, gateway in self._gateways.items()
+                for category in DeCONZRegistry.CATEGORIES
+                for dcz_id, device in gateway.get_devices(category).items()}
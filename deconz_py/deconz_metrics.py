@@ -0,0 +1,128 @@
+"""Module to collect deCONZ client metrics"""
+
+import logging
+from bisect import bisect_left
+
+_LOGGER = logging.getLogger(__name__)
+
+class Histogram:
+    """Cumulative histogram of observed values with fixed buckets."""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+               1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=BUCKETS):
+        """Initialize an empty histogram."""
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Add a value."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self):
+        """Return count, sum and the cumulative count per upper bound."""
+        cumulative = {}
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            cumulative[bound] = total
+        return {'count': self.count, 'sum': self.sum, 'buckets': cumulative}
+
+class DeCONZMetrics:
+    """Counters and histograms of a DeCONZApi.
+
+    Metrics are identified by name and a tuple of (label, value) pairs.
+    Hooks are called with (name, labels, value) on every observation.
+    One instance may be shared by several DeCONZApi instances.
+    """
+
+    def __init__(self, hooks=None):
+        """Initialize the metrics."""
+        self._counters = {}
+        self._histograms = {}
+        self._hooks = list(hooks or ())
+
+    def add_hook(self, hook):
+        """Call hook(name, labels, value) for every observation."""
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """Remove a hook."""
+        self._hooks.remove(hook)
+
+    def inc(self, name, labels=(), value=1):
+        """Increase a counter."""
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+        if self._hooks:
+            self._call_hooks(name, labels, value)
+
+    def observe(self, name, labels, value):
+        """Add a value to a histogram."""
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        histogram.observe(value)
+        if self._hooks:
+            self._call_hooks(name, labels, value)
+
+    def snapshot(self):
+        """Return all metrics as a dict of name -> list of samples."""
+        result = {}
+        for (name, labels), value in self._counters.items():
+            result.setdefault(name, []).append(
+                {'labels': dict(labels), 'value': value})
+        for (name, labels), histogram in self._histograms.items():
+            sample = histogram.as_dict()
+            sample['labels'] = dict(labels)
+            result.setdefault(name, []).append(sample)
+        return result
+
+    def prometheus(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, samples in sorted(self._group(self._counters).items()):
+            lines.append('# TYPE {} counter'.format(name))
+            for labels, value in samples:
+                lines.append('{}{} {}'.format(name, _labels(labels), value))
+        for name, samples in sorted(self._group(self._histograms).items()):
+            lines.append('# TYPE {} histogram'.format(name))
+            for labels, histogram in samples:
+                data = histogram.as_dict()
+                for bound, count in data['buckets'].items():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('{}_bucket{} {}'.format(
+                        name, _labels(labels + (('le', le),)), count))
+                lines.append('{}_sum{} {}'.format(name, _labels(labels),
+                                                  data['sum']))
+                lines.append('{}_count{} {}'.format(name, _labels(labels),
+                                                    data['count']))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _group(metrics):
+        grouped = {}
+        for (name, labels), value in metrics.items():
+            grouped.setdefault(name, []).append((labels, value))
+        return grouped
+
+    def _call_hooks(self, name, labels, value):
+        for hook in self._hooks:
+            try:
+                hook(name, labels, value)
+            except Exception:    # pylint: disable=broad-except
+                _LOGGER.exception("Exception in metrics hook, ignoring.")
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('"', '\\"'))
+                          for key, value in labels) + '}'
@@ -0,0 +1,170 @@
+"""Module to coalesce deCONZ state writes"""
+
+import logging
+import asyncio
+
+from .deconz_retry import RetryPolicy
+from .deconz_scheduler import DeCONZScheduler
+
+_LOGGER = logging.getLogger(__name__)
+
+class _PendingCommand:
+    """A merged state write waiting to be sent to the gateway."""
+
+    def __init__(self, priority):
+        self.payload = {}
+        self.futures = []
+        self.priority = priority
+        # the command flushed next for the same device
+        self.newer = None
+
+class DeCONZCommandQueue:
+    """Per-device write queue merging state changes into one command.
+
+    Every write for the same resource and id that is submitted within
+    `window` seconds is merged into a single payload, later values
+    overwrite earlier ones. Commands for the same device are sent one after
+    the other, so a merged command never overtakes an older one.
+
+    A failed command is retried with the retry policy unless a newer
+    command for the same device is already queued or flushed. In that
+    case it is folded into the newer one instead, so values that were
+    replaced in the meantime are never replayed.
+
+    With a scheduler every attempt waits for a token of its resource, a
+    merged command keeps the most urgent priority of its writes. The wait
+    does not count against the deadline of the retry policy.
+    """
+
+    def __init__(self, send, window=0.05, retry=None, metrics=None, #pylint: disable=too-many-arguments
+                 scheduler=None):
+        """Initialize the queue.
+
+        send is a coroutine function called with (resource, dcz_id, payload)
+        returning the gateway result, or False if the command failed.
+        Merged, retried and dropped commands and the time commands wait for
+        the scheduler are recorded in metrics if a DeCONZMetrics instance is
+        given. scheduler is an optional DeCONZScheduler.
+        """
+        self._send = send
+        self._window = window
+        self._retry = retry if retry is not None else RetryPolicy()
+        self._metrics = metrics
+        self._scheduler = scheduler
+        self._pending = {}
+        self._inflight = {}
+
+    @property
+    def window(self):
+        """Return the coalescing window in seconds."""
+        return self._window
+
+    @property
+    def scheduler(self):
+        """Return the DeCONZScheduler or None."""
+        return self._scheduler
+
+    def submit(self, resource, dcz_id, payload,
+               priority=DeCONZScheduler.INTERACTIVE):
+        """Queue a payload, return a future resolved with the gateway result."""
+        loop = asyncio.get_event_loop()
+        key = (resource, dcz_id)
+        future = loop.create_future()
+
+        command = self._pending.get(key)
+        if command is None:
+            command = self._pending[key] = _PendingCommand(priority)
+            loop.call_later(self._window, self._flush, key)
+        else:
+            command.priority = min(command.priority, priority)
+            if self._metrics is not None:
+                self._metrics.inc('deconz_commands_merged_total',
+                                  (('resource', resource),))
+        command.payload.update(payload)
+        command.futures.append(future)
+        return future
+
+    def cancel(self):
+        """Drop all queued commands and cancel their futures."""
+        pending, self._pending = self._pending, {}
+        for command in pending.values():
+            for future in command.futures:
+                future.cancel()
+        for task, _ in self._inflight.values():
+            task.cancel()
+        self._inflight = {}
+
+    def _flush(self, key):
+        command = self._pending.pop(key, None)
+        if command is None:
+            return
+        previous = self._inflight.get(key)
+        if previous is not None:
+            previous[1].newer = command
+            previous = previous[0]
+        task = asyncio.ensure_future(self._dispatch(key, command, previous))
+        self._inflight[key] = (task, command)
+        task.add_done_callback(lambda _: self._task_done(key, task))
+
+    def _task_done(self, key, task):
+        inflight = self._inflight.get(key)
+        if inflight is not None and inflight[0] is task:
+            del self._inflight[key]
+
+    def _newer(self, key, command):
+        """Return the command following command, flushed or still queued."""
+        if command.newer is not None:
+            return command.newer
+        return self._pending.get(key)
+
+    async def _dispatch(self, key, command, previous):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            result = await self._retry.call(
+                self._send, key[0], key[1], command.payload,
+                give_up=lambda: self._newer(key, command) is not None,
+                on_retry=None if self._metrics is None else
+                lambda: self._metrics.inc('deconz_retries_total',
+                                          (('kind', 'write'),)),
+                before=None if self._scheduler is None else
+                lambda: self._acquire(key[0], command))
+        except asyncio.CancelledError:
+            for future in command.futures:
+                future.cancel()
+            raise
+        except Exception as exc:    # pylint: disable=broad-except
+            _LOGGER.error("Failed to send command to %s/%s: %s",
+                          key[0], key[1], exc)
+            for future in command.futures:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        newer = self._newer(key, command) if result is False else None
+        if newer is not None:
+            # a flushed newer command waits for this one, so it is not sent
+            # yet and still takes the payload
+            _LOGGER.debug("Dropping outdated command for %s/%s.",
+                          key[0], key[1])
+            if self._metrics is not None:
+                self._metrics.inc('deconz_commands_superseded_total',
+                                  (('resource', key[0]),))
+            payload = dict(command.payload)
+            payload.update(newer.payload)
+            newer.payload = payload
+            newer.futures[:0] = command.futures
+            newer.priority = min(newer.priority, command.priority)
+            return
+        for future in command.futures:
+            if not future.done():
+                future.set_result(result)
+
+    async def _acquire(self, resource, command):
+        # waiting for a token does not count against the retry deadline
+        wait = await self._scheduler.acquire(resource, command.priority)
+        if self._metrics is not None:
+            self._metrics.observe(
+                'deconz_command_wait_seconds',
+                (('resource', resource),
+                 ('priority', DeCONZScheduler.PRIORITIES[command.priority])),
+                wait)
@@ -0,0 +1,151 @@
+"""Module to record websocket frames and replay them later"""
+
+import asyncio
+import glob
+import logging
+import os
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+# written whenever a capture file is opened: format version, wall clock
+# and monotonic time, and 'start' for a new session or 'rotated' if it
+# continues the session of the previous file
+_HEADER = '#deconz_py-capture 1 {:.6f} {:.6f} {}\n'
+
+class FrameRecorder:
+    """Append-only capture of raw websocket frames with rotation.
+
+    Every frame is written as one line, the monotonic time it was received
+    and the frame separated by a tab. When the file grows beyond max_bytes
+    it is renamed to path.1, older captures move to path.2 and so on, and
+    at most backups old files are kept. Every session, from the first
+    frame to close(), starts with a header line, so replays skip the time
+    between sessions.
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backups=3):
+        """Initialize the recorder, the file is opened on the first frame."""
+        self._path = path
+        self._max_bytes = max_bytes
+        self._backups = backups
+        self._file = None
+        self._size = 0
+        self._flushed = 0.0
+        self._frames = 0
+        self._rotated = False
+
+    @property
+    def path(self):
+        """Return the path of the current capture file."""
+        return self._path
+
+    @property
+    def frames(self):
+        """Return the number of frames recorded."""
+        return self._frames
+
+    def record(self, frame, timestamp=None):
+        """Append a frame received at timestamp, by default now."""
+        now = time.monotonic() if timestamp is None else timestamp
+        if self._file is None:
+            self._open()
+        # frames are JSON, a raw newline can only be whitespace
+        line = '{:.6f}\t{}\n'.format(now, frame.replace('\n', ' ')).encode()
+        self._file.write(line)
+        self._size += len(line)
+        self._frames += 1
+        if now - self._flushed >= 1.0:
+            self._file.flush()
+            self._flushed = now
+        if self._size >= self._max_bytes:
+            self._rotate()
+
+    def close(self):
+        """Flush and close the capture file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self):
+        self._file = open(self._path, 'ab')
+        kind = 'rotated' if self._rotated else 'start'
+        self._rotated = False
+        header = _HEADER.format(time.time(), time.monotonic(), kind).encode()
+        self._file.write(header)
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        self.close()
+        self._rotated = True
+        for index in range(self._backups - 1, 0, -1):
+            source = '{}.{}'.format(self._path, index)
+            if os.path.exists(source):
+                os.replace(source, '{}.{}'.format(self._path, index + 1))
+        if self._backups > 0:
+            os.replace(self._path, self._path + '.1')
+        else:
+            os.remove(self._path)
+
+def capture_files(path):
+    """Return path and its rotated captures, oldest first."""
+    rotated = [name for name in glob.glob(glob.escape(path) + '.*')
+               if name.rsplit('.', 1)[-1].isdigit()]
+    rotated.sort(key=lambda name: int(name.rsplit('.', 1)[-1]), reverse=True)
+    if os.path.exists(path):
+        rotated.append(path)
+    return rotated
+
+def read_capture(paths):
+    """Yield (timestamp, frame) of all frames in the capture files.
+
+    The timestamps of every session after the first are shifted to follow
+    the last frame of the previous one, so they increase steadily.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    offset = 0.0
+    last = None
+    new_session = False
+    for path in paths:
+        with open(path, encoding='utf-8') as capture:
+            for line in capture:
+                if line.startswith('#'):
+                    new_session = not line.rstrip().endswith(' rotated')
+                    continue
+                timestamp, _, frame = line.rstrip('\n').partition('\t')
+                timestamp = float(timestamp)
+                if new_session and last is not None:
+                    offset = last - timestamp
+                new_session = False
+                last = timestamp + offset
+                yield last, frame
+
+async def replay_capture(paths, callback, loads, speed=1.0):
+    """Feed captured frames to the coroutine function callback.
+
+    Every frame is decoded with loads. With speed 1.0 the frames are
+    replayed with their recorded timing, 2.0 replays twice as fast and
+    None as fast as possible. Returns the number of frames and the
+    largest delay behind the recorded schedule in seconds.
+    """
+    loop = asyncio.get_event_loop()
+    start = first = None
+    frames = 0
+    max_lag = 0.0
+    for timestamp, frame in read_capture(paths):
+        if speed:
+            if first is None:
+                start, first = loop.time(), timestamp
+            due = start + (timestamp - first) / speed
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+        try:
+            await callback(loads(frame))
+        except Exception:    # pylint: disable=broad-except
+            _LOGGER.exception("Exception replaying frame, ignoring.")
+        frames += 1
+    return {'frames': frames, 'max_lag': max_lag}
@@ -0,0 +1,193 @@
+"""Module to keep track of all known deCONZ devices"""
+
+class DeCONZRegistry:
+    """In-memory store of sensors, lights and groups.
+
+    Devices are kept in one dict per category keyed by their deCONZ id and
+    in a secondary index keyed by uniqueid, so every lookup is a dict access.
+    The member lights of every group are indexed in both directions, and
+    the devices of every category are indexed by every attribute of
+    INDEXED_FIELDS.
+    """
+
+    CATEGORIES = ('sensors', 'lights', 'groups')
+    INDEXED_FIELDS = ('device_type', 'manufacturername', 'modelid',
+                      'reachable', 'battery')
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._devices = {category: {} for category in self.CATEGORIES}
+        self._by_uniqueid = {}
+        # (category, id) -> uniqueid the device is indexed by
+        self._uniqueids = {}
+        self._group_lights = {}
+        self._light_groups = {}
+        # category -> field -> value -> set of ids
+        self._indexes = {category: {field: {} for field in
+                                    self.INDEXED_FIELDS}
+                         for category in self.CATEGORIES}
+        # (category, id) -> indexed values, in the order of INDEXED_FIELDS
+        self._indexed = {}
+
+    def __len__(self):
+        return sum(len(devices) for devices in self._devices.values())
+
+    def category(self, category):
+        """Return the dict of all devices in the category, keyed by id."""
+        return self._devices[category]
+
+    def get(self, category, dcz_id):
+        """Return the device or None if it is not known."""
+        devices = self._devices.get(category)
+        if devices is None:
+            return None
+        return devices.get(dcz_id)
+
+    def by_uniqueid(self, uniqueid):
+        """Return the device with the given uniqueid or None."""
+        return self._by_uniqueid.get(uniqueid)
+
+    def group_lights(self, group_id):
+        """Return the ids of the member lights of a group."""
+        return self._group_lights.get(group_id, frozenset())
+
+    def light_groups(self, light_id):
+        """Return the ids of the groups a light belongs to."""
+        return frozenset(self._light_groups.get(light_id, ()))
+
+    @property
+    def groups_by_members(self):
+        """Return a dict of group id -> set of member light ids."""
+        return self._group_lights
+
+    def add(self, category, device):
+        """Add a device, replacing a known device with the same id."""
+        self.remove(category, device.dcz_id)
+        self._devices[category][device.dcz_id] = device
+        if category == 'groups':
+            self.update_group(device)
+        self.reindex(category, device)
+
+    def update_group(self, group):
+        """Reindex the member lights of a group."""
+        self._unlink_group(group.dcz_id)
+        members = frozenset(group.lights)
+        self._group_lights[group.dcz_id] = members
+        for light_id in members:
+            self._light_groups.setdefault(light_id, set()).add(group.dcz_id)
+
+    def reindex(self, category, device):
+        """Update the uniqueid and attribute indexes after a device changed."""
+        key = (category, device.dcz_id)
+        uniqueid = getattr(device, 'uniqueid', None)
+        if uniqueid != self._uniqueids.get(key):
+            self._unlink_uniqueid(key)
+            if uniqueid is not None:
+                self._uniqueids[key] = uniqueid
+                self._by_uniqueid[uniqueid] = device
+
+        values = tuple(getattr(device, field, None)
+                       for field in self.INDEXED_FIELDS)
+        old = self._indexed.get(key)
+        if old == values:
+            return
+        self._indexed[key] = values
+        indexes = self._indexes[category]
+        for field, value, old_value in zip(self.INDEXED_FIELDS, values,
+                                           old or (None,) * len(values)):
+            if value == old_value and old is not None:
+                continue
+            index = indexes[field]
+            if old is not None:
+                self._discard(index, old_value, device.dcz_id)
+            if value is not None:
+                index.setdefault(value, set()).add(device.dcz_id)
+
+    def query(self, category=None, battery_below=None, **criteria):
+        """Return the devices having all the given attribute values.
+
+        criteria map fields of INDEXED_FIELDS to a value, like
+        device_type='ZHATemperature' or reachable=False. battery_below
+        selects devices with a battery level below it. Only the index
+        entries of the matching category are read, so a query takes time in
+        proportion to the number of matches, not of devices.
+        """
+        for field in criteria:
+            if field not in self.INDEXED_FIELDS:
+                raise ValueError('{} is not indexed'.format(field))
+        categories = self.CATEGORIES if category is None else (category,)
+        devices = []
+        for name in categories:
+            indexes = self._indexes[name]
+            matches = [indexes[field].get(value, ())
+                       for field, value in criteria.items()]
+            if battery_below is not None:
+                matches.append({dcz_id for level, ids in
+                                indexes['battery'].items()
+                                if isinstance(level, (int, float)) and
+                                not isinstance(level, bool) and
+                                level < battery_below for dcz_id in ids})
+            if not matches:
+                devices.extend(self._devices[name].values())
+                continue
+            matches.sort(key=len)
+            known = self._devices[name]
+            devices.extend(known[dcz_id] for dcz_id in
+                           set(matches[0]).intersection(*matches[1:]))
+        return devices
+
+    def _unindex(self, key):
+        old = self._indexed.pop(key, None)
+        if old is None:
+            return
+        indexes = self._indexes[key[0]]
+        for field, value in zip(self.INDEXED_FIELDS, old):
+            self._discard(indexes[field], value, key[1])
+
+    def _unlink_uniqueid(self, key):
+        uniqueid = self._uniqueids.pop(key, None)
+        if uniqueid is not None and \
+                self._by_uniqueid.get(uniqueid) is \
+                self._devices[key[0]].get(key[1]):
+            del self._by_uniqueid[uniqueid]
+
+    @staticmethod
+    def _discard(index, value, dcz_id):
+        ids = index.get(value)
+        if ids is not None:
+            ids.discard(dcz_id)
+            if not ids:
+                del index[value]
+
+    def _unlink_group(self, group_id):
+        for light_id in self._group_lights.pop(group_id, ()):
+            groups = self._light_groups.get(light_id)
+            if groups is not None:
+                groups.discard(group_id)
+                if not groups:
+                    del self._light_groups[light_id]
+
+    def remove(self, category, dcz_id):
+        """Remove a device, return it or None if it was not known."""
+        device = self._devices[category].get(dcz_id)
+        if device is None:
+            return None
+        self._unlink_uniqueid((category, dcz_id))
+        del self._devices[category][dcz_id]
+        if category == 'groups':
+            self._unlink_group(dcz_id)
+        self._unindex((category, dcz_id))
+        return device
+
+    def clear(self):
+        """Remove all devices."""
+        for devices in self._devices.values():
+            devices.clear()
+        self._by_uniqueid.clear()
+        self._uniqueids.clear()
+        self._group_lights.clear()
+        self._light_groups.clear()
+        for indexes in self._indexes.values():
+            for index in indexes.values():
+                index.clear()
+        self._indexed.clear()
@@ -0,0 +1,74 @@
+"""Module to retry deCONZ gateway calls"""
+
+import logging
+import asyncio
+import random
+
+_LOGGER = logging.getLogger(__name__)
+
+class RetryPolicy:
+    """Retry a gateway call with exponential backoff, jitter and a deadline.
+
+    A call is considered failed when it returns False. The delay before
+    retry n is initial_delay * multiplier ** (n - 1), capped at max_delay
+    and reduced by up to `jitter` (a fraction) at random, so clients do not
+    retry in lockstep. No attempt is started after `deadline` seconds.
+    """
+
+    def __init__(self, attempts=5, initial_delay=0.25, max_delay=4.0, #pylint: disable=too-many-arguments
+                 multiplier=2.0, jitter=0.5, deadline=15.0):
+        """Initialize the retry policy."""
+        self.attempts = attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.deadline = deadline
+
+    def backoff(self, attempt):
+        """Return the delay in seconds after the given failed attempt."""
+        delay = min(self.max_delay,
+                    self.initial_delay * self.multiplier ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    async def call(self, func, *args, give_up=None, on_retry=None, #pylint: disable=too-many-arguments
+                   before=None):
+        """Call the coroutine function func until it does not return False.
+
+        give_up is an optional callable checked before every retry, the
+        call is abandoned and False returned as soon as it returns True.
+        on_retry is called without arguments before every retry. before is
+        an optional coroutine function awaited before every attempt, the
+        time it takes does not count against the deadline.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            if before is not None:
+                start = loop.time()
+                await before()
+                deadline += loop.time() - start
+            remaining = deadline - loop.time()
+            try:
+                result = await asyncio.wait_for(func(*args), remaining)
+            except asyncio.TimeoutError:
+                _LOGGER.error("Deadline of %.1fs exceeded for %s.",
+                              self.deadline, getattr(func, '__name__', func))
+                return False
+            if result is not False:
+                return result
+            if attempt >= self.attempts:
+                return False
+
+            delay = self.backoff(attempt)
+            if loop.time() + delay >= deadline:
+                return False
+            _LOGGER.debug("Attempt %d failed, retrying in %.2fs.",
+                          attempt, delay)
+            await asyncio.sleep(delay)
+            if give_up is not None and give_up():
+                return False
+            if on_retry is not None:
+                on_retry()
@@ -0,0 +1,123 @@
+"""Module to rate limit the commands sent to a deCONZ gateway"""
+
+import asyncio
+import heapq
+import itertools
+
+class _TokenBucket:
+    """Token bucket refilled with rate tokens per second up to burst."""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'waiters', 'timer')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = None
+        # heap of (priority, sequence, future)
+        self.waiters = []
+        self.timer = None
+
+    def take(self, now):
+        """Take a token, return False if none is left."""
+        if self.updated is not None:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def delay(self):
+        """Return the seconds until the next token is available."""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+class DeCONZScheduler:
+    """Token bucket rate limiter for light and group commands.
+
+    Lights and groups have separate buckets, as a group command costs the
+    gateway far more Zigbee airtime than a command to a single light.
+    Commands waiting for a token are released by priority, INTERACTIVE
+    before AUTOMATION before BACKGROUND, and in submission order within a
+    priority. Nothing is dropped, commands only wait.
+    """
+
+    INTERACTIVE = 0
+    AUTOMATION = 1
+    BACKGROUND = 2
+    PRIORITIES = ('interactive', 'automation', 'background')
+
+    def __init__(self, light_rate=10.0, light_burst=10, group_rate=1.0, #pylint: disable=too-many-arguments
+                 group_burst=2):
+        """Initialize the scheduler.
+
+        The rates are the sustained commands per second, the bursts the
+        number of commands sent at once after a quiet period. A rate of
+        None disables the limit for that resource.
+        """
+        self._buckets = {}
+        for resource, rate, burst in (('lights', light_rate, light_burst),
+                                      ('groups', group_rate, group_burst)):
+            if rate is not None:
+                self._buckets[resource] = _TokenBucket(rate, max(1, burst))
+        self._sequence = itertools.count()
+        self._stats = {name: {'commands': 0, 'total_wait': 0.0,
+                              'max_wait': 0.0}
+                       for name in self.PRIORITIES}
+
+    @property
+    def stats(self):
+        """Return commands, total and max queue wait in seconds by priority."""
+        return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def waiting(self, resource=None):
+        """Return the number of commands waiting for a token."""
+        if resource is None:
+            buckets = self._buckets.values()
+        else:
+            buckets = [self._buckets[resource]] \
+                if resource in self._buckets else []
+        return sum(1 for bucket in buckets
+                   for _, _, future in bucket.waiters if not future.done())
+
+    async def acquire(self, resource, priority=INTERACTIVE):
+        """Wait for a token to send a command, return the wait in seconds."""
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        bucket = self._buckets.get(resource)
+        if bucket is not None and \
+                (bucket.waiters or not bucket.take(start)):
+            future = loop.create_future()
+            heapq.heappush(bucket.waiters,
+                           (priority, next(self._sequence), future))
+            self._schedule(bucket, loop)
+            await future
+        wait = loop.time() - start
+        stats = self._stats[self.PRIORITIES[priority]]
+        stats['commands'] += 1
+        stats['total_wait'] += wait
+        stats['max_wait'] = max(stats['max_wait'], wait)
+        return wait
+
+    def _schedule(self, bucket, loop):
+        if bucket.timer is None:
+            bucket.timer = loop.call_later(bucket.delay(), self._release,
+                                           bucket, loop)
+
+    def _release(self, bucket, loop):
+        bucket.timer = None
+        now = loop.time()
+        waiters = bucket.waiters
+        while waiters:
+            future = waiters[0][2]
+            if future.done():
+                # the waiting command was cancelled
+                heapq.heappop(waiters)
+                continue
+            if not bucket.take(now):
+                break
+            heapq.heappop(waiters)
+            future.set_result(None)
+        if waiters:
+            self._schedule(bucket, loop)
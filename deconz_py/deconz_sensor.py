@@ -1,11 +1,35 @@
 """Module to represent a deCONZ Sensor"""
 
 import logging
-import asyncio
+
+from .deconz_device import DeCONZDevice, intern
 
 _LOGGER = logging.getLogger(__name__)
 
-class DeCONZSensor:
+def state_field(name, divisor=None):
+    """Return a decoder reading one field of the state, optionally scaled."""
+    if divisor is None:
+        return lambda state: state[name]
+    divisor = float(divisor)
+    return lambda state: state[name] / divisor
+
+def decode_lightlevel(state):
+    """Convert the logarithmic deCONZ light level to lux."""
+    return round(10 ** ((state['lightlevel'] - 1) / 10000), 0)
+
+def decode_unknown(state): #pylint: disable=unused-argument
+    """Decoder used for sensor types without a registered decoder."""
+    return "unknown"
+
+_MISSING = object()
+
+def _changed_keys(old, new):
+    """Return the keys of new with another value in old, but lastupdated."""
+    old = old or {}
+    return [key for key, value in new.items()
+            if key != 'lastupdated' and old.get(key, _MISSING) != value]
+
+class DeCONZSensor(DeCONZDevice):
     """Represents a sensor based on an DeConz Sensor."""
 
     ZHATEMPERATURE = 'ZHATemperature'
@@ -26,113 +50,162 @@ class DeCONZSensor:
     CLIPHUMIDITY = 'CLIPHumidity'
     CLIPGENERICFLAG = 'CLIPGenericFlag'
     CLIPGENERICSTATUS = 'CLIPGenericStatus'
+    ZHAPOWER = 'ZHAPower'
+    ZHACONSUMPTION = 'ZHAConsumption'
+    ZHAVIBRATION = 'ZHAVibration'
+    ZHACARBONMONOXIDE = 'ZHACarbonMonoxide'
+    ZHAFIRE = 'ZHAFire'
+    ZHABATTERY = 'ZHABattery'
+
+    # device type -> callable converting the state dict to the current state
+    DECODERS = {}
+
+    # types reporting events rather than a state, like button presses. A
+    # new lastupdated is a new event even if the state repeats.
+    EVENT_TYPES = {ZHASWITCH, CLIPSWITCH}
 
-    def __init__(self, dcz_id, name, device_type):
-        """Initialize the sensor device."""
-        self._dcz_id = dcz_id
-        self._name = name
+    @classmethod
+    def register_decoder(cls, device_types, decoder):
+        """Register the decoder for one or more device types.
+
+        decoder is called with the state dict of every update and returns
+        the current state. A KeyError results in the state "unknown".
+        """
+        if isinstance(device_types, str):
+            device_types = (device_types,)
+        for device_type in device_types:
+            cls.DECODERS[device_type] = decoder
+
+    __slots__ = ('_keep_raw', '_state', '_config', '_decoder',
+                 '_current_state', '_lastupdated', '_battery', '_on',
+                 '_reachable', '_ep', '_manufacturername', '_modelid',
+                 '_swversion', '_history')
+
+    SNAPSHOT_FIELDS = DeCONZDevice.SNAPSHOT_FIELDS + (
+        'current_state', 'lastupdated', 'battery', 'on', 'reachable', 'ep',
+        'manufacturername', 'modelid', 'swversion', 'state', 'config')
+
+    def __init__(self, dcz_id, name, device_type, keep_raw=False, #pylint: disable=too-many-arguments
+                 history=None):
+        """Initialize the sensor device.
+
+        The raw state and config dicts of the last update are only kept if
+        keep_raw is set, otherwise just the normalised values are stored.
+        Every decoded state is added to history, a SensorHistory, if given.
+        """
+        super().__init__(dcz_id, name, device_type)
+        self._keep_raw = keep_raw
         self._state = None
         self._config = None
-        self._device_type = device_type
+        self._decoder = self.DECODERS.get(device_type, decode_unknown)
         self._current_state = None
+        self._lastupdated = None
+        self._battery = None
+        self._on = None
+        self._reachable = None
         self._ep = None
-        self._etag = None
         self._manufacturername = None
         self._modelid = None
         self._swversion = None
-        self._uniqueid = None
-        self._update_listeners = []
+        self._history = history
 
-    @asyncio.coroutine
-    def update(self, data):
-        """Update the state of the device."""
+    async def update(self, data):
+        """Update the state of the device.
 
+        Returns the set of attributes that changed. Listeners are only
+        notified if there is one, a new lastupdated or etag alone is no
+        change, but for EVENT_TYPES.
+        """
+        changed = set()
         if 'state' in data:
+            state = data['state']
+            if self._keep_raw:
+                changed.update(_changed_keys(self._state, state))
+                self._state = state
             try:
-                self._state = data['state']
-                if self._device_type == self.ZHATEMPERATURE or \
-                   self._device_type == self.CLIPTEMPERATURE:
-                    current_state = self._state['temperature']/float(100)
-                elif self._device_type == self.ZHAHUMIDITY or \
-                     self._device_type == self.CLIPHUMIDITY:
-                    current_state = self._state['humidity']/float(100)
-                elif self._device_type == self.ZHAPRESSURE:
-                    current_state = self._state['pressure']
-                elif self._device_type == self.ZHALIGHTLEVEL:
-                    current_state = round(10 ** (float(self._state['lightlevel'] - 1) / 10000), 0)
-                elif self._device_type == self.ZHASWITCH or \
-                     self._device_type == self.CLIPSWITCH:
-                    current_state = self._state['buttonevent']
-                elif self._device_type == self.ZHAPRESENCE or \
-                     self._device_type == self.CLIPPRESENCE:
-                    current_state = self._state['presence']
-                elif self._device_type == self.ZHAOPENCLOSE or \
-                     self._device_type == self.CLIPOPENCLOSE:
-                    current_state = self._state['open']
-                elif self._device_type == self.ZHAWATER or \
-                     self._device_type == self.CLIPWATER:
-                    current_state = self._state['water']
-                elif self._device_type == self.ZHAALARM or \
-                     self._device_type == self.CLIPALARM:
-                    current_state = self._state['alarm']
-                elif self._device_type == self.CLIPGENERICFLAG:
-                    current_state = self._state['flag']
-                elif self._device_type == self.CLIPGENERICSTATUS:
-                    current_state = self._state['status']
-                else:
-                    current_state = "unknown"
+                current_state = self._decoder(state)
             except KeyError:
                 current_state = "unknown"
 
-            self._current_state = current_state
+            lastupdated = state.get('lastupdated')
+            if current_state != self._current_state or \
+                    (self._device_type in self.EVENT_TYPES and
+                     lastupdated is not None and
+                     lastupdated != self._lastupdated):
+                self._current_state = current_state
+                changed.add('current_state')
+                changed.update(key for key in state if key != 'lastupdated')
+            self._lastupdated = lastupdated
+            if self._history is not None:
+                self._history.append(current_state)
         if 'config' in data:
-            self._config = data['config']
-            if 'battery' not in self._config:
-                self._config['battery'] = 'unknown'
-                
+            config = data['config']
+            if 'battery' not in config:
+                config['battery'] = 'unknown'
+            if self._keep_raw:
+                changed.update(_changed_keys(self._config, config))
+                self._config = config
+            self._set_field('battery', '_battery', config['battery'], changed)
+            self._set_field('on', '_on', config.get('on'), changed)
+            self._set_field('reachable', '_reachable', config.get('reachable'),
+                            changed)
+
         if 'ep' in data:
-            self._ep = data['ep']
+            self._set_field('ep', '_ep', data['ep'], changed)
         if 'etag' in data:
             self._etag = data['etag']
-        if 'manufacturername' in data:
-            self._manufacturername = data['manufacturername']
-        if 'modelid' in data:
-            self._modelid = data['modelid']
-        if 'swversion' in data:
-            self._swversion = data['swversion']
+        for field in ('manufacturername', 'modelid', 'swversion'):
+            if field in data:
+                self._set_field(field, '_' + field, intern(data[field]),
+                                changed)
         if 'uniqueid' in data:
-            self._uniqueid = data['uniqueid']
-        
-        for update_listener in self._update_listeners:
-            yield from update_listener(data)
+            self._set_field('uniqueid', '_uniqueid', data['uniqueid'], changed)
 
-    def add_update_listener(self, update_listener):
-        """update_listener is called as soon as the sensor receives an update"""
-        self._update_listeners.append(update_listener)
+        if changed:
+            await self._notify_listeners(data, changed)
+        return changed
 
-    def remove_update_listener(self, update_listener):
-        """remove an update_listener"""
-        self._update_listeners.remove(update_listener)
-
-    @property
-    def dcz_id(self):
-        """Return the deconz id"""
-        return self._dcz_id
-
-    @property
-    def name(self):
-        """The name of the device."""
-        return self._name
+    def restore(self, data):
+        """Set the attributes of a snapshot, listeners are not notified."""
+        if not self._keep_raw:
+            data = {key: value for key, value in data.items()
+                    if key not in ('state', 'config')}
+        super().restore(data)
+        for field in ('manufacturername', 'modelid', 'swversion'):
+            setattr(self, '_' + field, intern(getattr(self, '_' + field)))
 
     @property
     def state(self):
-        """The state of the sensor."""
+        """The raw state of the sensor, None unless raw payloads are kept."""
         return self._state
 
     @property
     def config(self):
         """The config of the sensor."""
-        return self._config
+        if self._config is not None or self._battery is None:
+            return self._config
+        return {'battery': self._battery, 'on': self._on,
+                'reachable': self._reachable}
+
+    @property
+    def history(self):
+        """The SensorHistory of the sensor or None."""
+        return self._history
+
+    @property
+    def battery(self):
+        """The battery level of the sensor."""
+        return self._battery
+
+    @property
+    def reachable(self):
+        """Return true if the sensor is reachable."""
+        return self._reachable
+
+    @property
+    def lastupdated(self):
+        """The time of the last state update reported by deCONZ."""
+        return self._lastupdated
 
     @property
     def current_state(self):
@@ -149,11 +222,6 @@ class DeCONZSensor:
         """The ep of the sensor."""
         return self._ep
 
-    @property
-    def etag(self):
-        """The etag of the sensor."""
-        return self._etag
-
     @property
     def manufacturername(self):
         """The manufacturername of the sensor."""
@@ -169,7 +237,41 @@ class DeCONZSensor:
         """The swversion of the sensor."""
         return self._swversion
 
-    @property
-    def uniqueid(self):
-        """The uniqueid of the sensor."""
-        return self._uniqueid
+DeCONZSensor.register_decoder((DeCONZSensor.ZHATEMPERATURE,
+                               DeCONZSensor.CLIPTEMPERATURE),
+                              state_field('temperature', 100))
+DeCONZSensor.register_decoder((DeCONZSensor.ZHAHUMIDITY,
+                               DeCONZSensor.CLIPHUMIDITY),
+                              state_field('humidity', 100))
+DeCONZSensor.register_decoder(DeCONZSensor.ZHAPRESSURE,
+                              state_field('pressure'))
+DeCONZSensor.register_decoder(DeCONZSensor.ZHALIGHTLEVEL, decode_lightlevel)
+DeCONZSensor.register_decoder((DeCONZSensor.ZHASWITCH,
+                               DeCONZSensor.CLIPSWITCH),
+                              state_field('buttonevent'))
+DeCONZSensor.register_decoder((DeCONZSensor.ZHAPRESENCE,
+                               DeCONZSensor.CLIPPRESENCE),
+                              state_field('presence'))
+DeCONZSensor.register_decoder((DeCONZSensor.ZHAOPENCLOSE,
+                               DeCONZSensor.CLIPOPENCLOSE),
+                              state_field('open'))
+DeCONZSensor.register_decoder((DeCONZSensor.ZHAWATER,
+                               DeCONZSensor.CLIPWATER),
+                              state_field('water'))
+DeCONZSensor.register_decoder((DeCONZSensor.ZHAALARM,
+                               DeCONZSensor.CLIPALARM),
+                              state_field('alarm'))
+DeCONZSensor.register_decoder(DeCONZSensor.CLIPGENERICFLAG,
+                              state_field('flag'))
+DeCONZSensor.register_decoder(DeCONZSensor.CLIPGENERICSTATUS,
+                              state_field('status'))
+DeCONZSensor.register_decoder(DeCONZSensor.ZHAPOWER, state_field('power'))
+DeCONZSensor.register_decoder(DeCONZSensor.ZHACONSUMPTION,
+                              state_field('consumption'))
+DeCONZSensor.register_decoder(DeCONZSensor.ZHAVIBRATION,
+                              state_field('vibration'))
+DeCONZSensor.register_decoder(DeCONZSensor.ZHACARBONMONOXIDE,
+                              state_field('carbonmonoxide'))
+DeCONZSensor.register_decoder(DeCONZSensor.ZHAFIRE, state_field('fire'))
+DeCONZSensor.register_decoder(DeCONZSensor.ZHABATTERY,
+                              state_field('battery'))
@@ -0,0 +1,54 @@
+"""Module to keep a snapshot of all devices on disk between restarts"""
+
+import logging
+import os
+import tempfile
+
+_LOGGER = logging.getLogger(__name__)
+
+# bumped whenever the layout of the snapshot changes, older snapshots are
+# ignored then
+SNAPSHOT_VERSION = 2
+
+def write_snapshot(path, snapshot, codec):
+    """Write a snapshot dict to path atomically.
+
+    The data is written to a temporary file next to path and moved over it,
+    so readers find either the old or the new snapshot, never a partial one.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, tmp_path = tempfile.mkstemp(prefix='.deconz_py-', suffix='.tmp',
+                                        dir=directory)
+    try:
+        with os.fdopen(handle, 'w', encoding='utf-8') as tmp_file:
+            tmp_file.write(codec.dumps(dict(snapshot,
+                                            version=SNAPSHOT_VERSION)))
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def read_snapshot(path, codec):
+    """Return the snapshot dict stored at path.
+
+    None is returned if there is no snapshot, if it can not be read or if
+    it was written with another schema version.
+    """
+    try:
+        with open(path, encoding='utf-8') as snapshot_file:
+            snapshot = codec.loads(snapshot_file.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as err:
+        _LOGGER.warning("Ignoring unreadable snapshot %s: %s", path, err)
+        return None
+    if not isinstance(snapshot, dict) or \
+            snapshot.get('version') != SNAPSHOT_VERSION:
+        _LOGGER.info("Ignoring snapshot %s of another version.", path)
+        return None
+    return snapshot
@@ -0,0 +1,112 @@
+"""Module with a blocking facade for DeCONZApi"""
+
+import asyncio
+import concurrent.futures
+import threading
+
+from .deconz_api import DeCONZApi
+
+class DeCONZSyncApi:
+    """Blocking facade running a DeCONZApi on its own event loop.
+
+    The loop runs in a background thread, so blocking callers can load
+    devices and send commands without running, stalling or closing the
+    event loop of the host application. Devices are updated in the
+    background thread; treat them as read-only outside of it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the facade, arguments are passed on to DeCONZApi."""
+        self._args = args
+        self._kwargs = kwargs
+        self._loop = None
+        self._thread = None
+        self._api = None
+
+    def __enter__(self):
+        self.load()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def api(self):
+        """Return the DeCONZApi running in the background thread."""
+        return self._api
+
+    def load(self, timeout=None):
+        """Start the background loop and load all devices.
+
+        If loading fails the loop is stopped again before the error is
+        raised, so load can be retried.
+        """
+        if self._thread is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name='deconz_py', daemon=True)
+        self._thread.start()
+        try:
+            self._api = self.run(self._create_api(), timeout)
+            self.run(self._api.async_load(), timeout)
+        except BaseException:
+            self.stop(timeout)
+            raise
+
+    def stop(self, timeout=None):
+        """Stop the websocket listener, clear devices and end the thread."""
+        if self._thread is None:
+            return
+        try:
+            if self._api is not None:
+                self.run(self._api.async_stop(), timeout)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+            self._loop.close()
+            self._thread = None
+            self._loop = None
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the background loop and return its result.
+
+        The coroutine is cancelled if it does not finish within timeout.
+        """
+        if self._loop is None:
+            raise RuntimeError('DeCONZSyncApi is not loaded')
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def get_devices(self, category):
+        """Return a copy of the devices in this category.
+
+        The copy is taken on the background loop, so it can be iterated
+        while the loop adds or removes devices.
+        """
+        return self.run(self._get_devices(category))
+
+    def set_light(self, light, timeout=None):
+        """Send the state of the light and return the gateway result."""
+        return self.run(self._set_light(light), timeout)
+
+    def turn_on(self, light, timeout=None):
+        """Instruct the light to turn on."""
+        return self.run(light.turn_on(), timeout)
+
+    def turn_off(self, light, timeout=None):
+        """Instruct the light to turn off."""
+        return self.run(light.turn_off(), timeout)
+
+    async def _create_api(self):
+        return DeCONZApi(*self._args, **self._kwargs)
+
+    async def _get_devices(self, category):
+        return dict(self._api.get_devices(category))
+
+    async def _set_light(self, light):
+        return await self._api.set_light(light)
@@ -2,8 +2,8 @@ from distutils.core import setup
 setup(
     name='deconz_py',
     packages=['deconz_py'],
-    python_requires='>=3.3',
-    version='1.0.2',
+    python_requires='>=3.7',
+    version='2.0.0',
     description='Control deCONZ over the Rest API',
     author='Roman Reibnagel',
     author_email='roman.reibnagel@gmail.com',
@@ -0,0 +1,30 @@
+"""Helpers running DeCONZApi against the fake gateway"""
+
+import asyncio
+
+from deconz_py import DeCONZApi
+from fake_gateway import FakeGateway
+
+def run(coro, timeout=30):
+    """Run a coroutine on a new event loop."""
+    return asyncio.run(asyncio.wait_for(coro, timeout))
+
+async def start(gateway=None, load=True, **options):
+    """Start a fake gateway and return it with a DeCONZApi for it."""
+    if gateway is None:
+        gateway = FakeGateway(sensors=4, lights=4, groups=1)
+    await gateway.start()
+    api = DeCONZApi('127.0.0.1', gateway.port, gateway.ws_port,
+                    gateway.api_key, **options)
+    if load:
+        await api.async_load()
+    return gateway, api
+
+async def stop(gateway, api):
+    """Stop the api and the fake gateway."""
+    await api.async_stop()
+    await gateway.stop()
+
+async def settle(delay=0.1):
+    """Give websocket events time to be dispatched."""
+    await asyncio.sleep(delay)
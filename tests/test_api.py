@@ -0,0 +1,228 @@
+"""Tests of loading and websocket handling of DeCONZApi"""
+
+import asyncio
+
+from deconz_py import DeCONZApi, RetryPolicy
+from fake_gateway import FakeGateway
+
+from helpers import run, settle, start, stop
+
+def test_event_in_the_same_second_as_the_load_is_kept():
+    async def scenario():
+        gateway, api = await start(FakeGateway(sensors=1))
+        sensor = api.get_devices('sensors')['1']
+        try:
+            event = {'e': 'changed', 'r': 'sensors', 'id': '1',
+                     'state': {'lastupdated': sensor.lastupdated}}
+            same_second = api._is_stale(event)    # pylint: disable=protected-access
+            event['state']['lastupdated'] = '2000-01-01T00:00:00'
+            older = api._is_stale(event)    # pylint: disable=protected-access
+        finally:
+            await stop(gateway, api)
+        return same_second, older
+
+    same_second, older = run(scenario())
+    assert not same_second
+    assert older
+
+def test_sensor_that_never_reported_has_no_stale_events():
+    async def scenario():
+        gateway = FakeGateway(sensors=1)
+        gateway.tree['sensors']['1']['state']['lastupdated'] = 'none'
+        gateway, api = await start(gateway)
+        try:
+            return api._is_stale({    # pylint: disable=protected-access
+                'e': 'changed', 'r': 'sensors', 'id': '1',
+                'state': {'lastupdated': '2026-10-18T08:00:00'}})
+        finally:
+            await stop(gateway, api)
+
+    assert not run(scenario())
+
+def test_load_fails_if_a_category_can_not_be_fetched():
+    async def scenario():
+        gateway = FakeGateway(sensors=1, lights=1, error_rate=1.0)
+        gateway, api = await start(
+            gateway, load=False, read_retry=RetryPolicy(attempts=1))
+        try:
+            await api.async_load()
+        except ConnectionError as err:
+            return str(err), len(api.get_devices('sensors'))
+        finally:
+            await stop(gateway, api)
+        return None, None
+
+    error, sensors = run(scenario())
+    assert error == 'Failed to load sensors, lights, groups'
+    assert sensors == 0
+
+def test_query_unreachable_skips_groups():
+    async def scenario():
+        gateway, api = await start(FakeGateway(lights=2, groups=1))
+        try:
+            await gateway.push({'t': 'event', 'e': 'changed', 'r': 'lights',
+                                'id': '2', 'state': {'reachable': False}})
+            await settle()
+            return ([device.dcz_id for device in api.query(reachable=False)],
+                    api.get_devices('groups')['1'].reachable)
+        finally:
+            await stop(gateway, api)
+
+    unreachable, group_reachable = run(scenario())
+    assert unreachable == ['2']
+    assert group_reachable is None
+
+def test_reconnect_skips_categories_being_loaded():
+    async def scenario():
+        gateway, api = await start(
+            ws_reconnect=RetryPolicy(initial_delay=0.05, max_delay=0.05))
+        resynced = []
+
+        async def resync(categories=None):
+            resynced.append(categories)
+            return 0
+        api.async_resync = resync
+        # pretend the sensors are still being fetched by async_load
+        api._loading = {'sensors': []}    # pylint: disable=protected-access
+        try:
+            await gateway.disconnect()
+            for _ in range(50):
+                await settle(0.05)
+                if resynced:
+                    break
+        finally:
+            api._loading = {}    # pylint: disable=protected-access
+            await stop(gateway, api)
+        return resynced
+
+    assert run(scenario()) == [['lights', 'groups']]
+
+def test_stop_while_the_dispatch_queue_is_full():
+    async def scenario():
+        gateway, api = await start(FakeGateway(sensors=1),
+                                   dispatch_queue_size=2, dispatch_workers=1)
+
+        async def slow(data):
+            await asyncio.sleep(0.5)
+        api.get_devices('sensors')['1'].add_update_listener(slow)
+        for _ in range(20):
+            await gateway.push(gateway.sensor_event('1'))
+        await settle()
+        try:
+            await asyncio.wait_for(api.async_stop(), 2)
+        finally:
+            await gateway.stop()
+
+    run(scenario())
+
+def test_events_of_unsubscribed_devices_are_skipped():
+    async def scenario():
+        gateway, api = await start(FakeGateway(lights=2),
+                                   skip_unsubscribed_events=True)
+        seen = []
+        api.get_devices('lights')['1'].add_update_listener(seen.append)
+        try:
+            # the nested id must not be taken for the id of the event
+            await gateway.push({'attr': {'id': '2'}, 'e': 'changed',
+                                'id': '1', 'r': 'lights', 't': 'event',
+                                'state': {'bri': 3}})
+            await gateway.push({'e': 'changed', 'id': '2', 'r': 'lights',
+                                't': 'event', 'state': {'bri': 4}})
+            await settle()
+            return seen, api.get_devices('lights')['2'].brightness
+        finally:
+            await stop(gateway, api)
+
+    seen, unsubscribed = run(scenario())
+    assert len(seen) == 1
+    assert unsubscribed != 4
+
+def test_no_session_is_opened_after_stop():
+    async def scenario():
+        gateway, api = await start(FakeGateway(sensors=1),
+                                   read_retry=RetryPolicy(attempts=1))
+        await api.async_stop()
+        try:
+            return await api.get_data('sensors'), api.session
+        finally:
+            await gateway.stop()
+
+    assert run(scenario()) == (False, None)
+
+def test_snapshot_is_revalidated_in_the_background(tmp_path):
+    async def scenario():
+        path = str(tmp_path / 'snapshot.json')
+        gateway, api = await start(FakeGateway(sensors=2), snapshot_path=path)
+        await api.async_stop()
+        gateway.sensor_event('1')
+        api = DeCONZApi('127.0.0.1', gateway.port, gateway.ws_port,
+                        gateway.api_key, snapshot_path=path)
+        try:
+            await api.async_load()
+            sensor = api.get_devices('sensors')['1']
+            restored = sensor.etag
+            for _ in range(50):
+                await settle(0.05)
+                if sensor.etag != restored:
+                    break
+            return restored, sensor.etag
+        finally:
+            await stop(gateway, api)
+
+    restored, revalidated = run(scenario())
+    assert restored != revalidated
+
+def test_query_follows_changes():
+    async def scenario():
+        gateway, api = await start(FakeGateway(sensors=6))
+        try:
+            temperature = [device.dcz_id for device in
+                           api.query('sensors', device_type='ZHATemperature')]
+            await gateway.push({'t': 'event', 'e': 'changed', 'r': 'sensors',
+                                'id': '2', 'config': {'battery': 5}})
+            await settle()
+            low = [device.dcz_id for device in api.query(battery_below=10)]
+        finally:
+            await stop(gateway, api)
+        return temperature, low
+
+    temperature, low = run(scenario())
+    assert temperature == ['6']
+    assert low == ['2']
+
+def test_devices_are_polled_without_websocket():
+    async def scenario():
+        gateway, api = await start(
+            FakeGateway(sensors=2), poll_interval=0.05,
+            ws_reconnect=RetryPolicy(initial_delay=1.0, max_delay=1.0))
+        sensor = api.get_devices('sensors')['1']
+        before = sensor.current_state
+        try:
+            gateway.websocket_enabled = False
+            await gateway.disconnect()
+            gateway.sensor_event('1')
+            for _ in range(40):
+                await settle(0.05)
+                if sensor.current_state != before:
+                    break
+            return before, sensor.current_state, api.websocket_stats
+        finally:
+            await stop(gateway, api)
+
+    before, after, stats = run(scenario())
+    assert after != before
+    assert stats['polls'] >= 1
+
+def test_applying_events_is_timed():
+    async def scenario():
+        gateway, api = await start(FakeGateway(sensors=1), metrics=True)
+        try:
+            await gateway.push(gateway.sensor_event('1'))
+            await settle()
+            return api.metrics.snapshot()
+        finally:
+            await stop(gateway, api)
+
+    samples = run(scenario())['deconz_event_apply_seconds']
+    assert [sample['labels'] for sample in samples] == [{'r': 'sensors'}]
+    assert samples[0]['count'] == 1
@@ -0,0 +1,33 @@
+"""Tests of the change detection of devices"""
+
+from deconz_py import DeCONZSensor
+
+from helpers import run
+
+def _sensor(device_type, state):
+    sensor = DeCONZSensor('1', 'Sensor', device_type)
+    run(sensor.update({'state': state}))
+    return sensor
+
+def test_unchanged_state_is_suppressed():
+    sensor = _sensor('ZHATemperature',
+                     {'temperature': 2100, 'lastupdated': '2019-01-01T00:00:00'})
+    calls = []
+    sensor.add_update_listener(calls.append)
+    changed = run(sensor.update({'state': {
+        'temperature': 2100, 'lastupdated': '2019-01-01T00:00:05'}}))
+    assert changed == set()
+    assert not calls
+
+def test_repeated_button_press_is_a_change():
+    sensor = _sensor('ZHASwitch',
+                     {'buttonevent': 1002, 'lastupdated': '2019-01-01T00:00:00'})
+    calls = []
+    sensor.add_update_listener(calls.append)
+    changed = run(sensor.update({'state': {
+        'buttonevent': 1002, 'lastupdated': '2019-01-01T00:00:05'}}))
+    assert 'buttonevent' in changed
+    assert len(calls) == 1
+    # the same frame again is no new press
+    assert run(sensor.update({'state': {
+        'buttonevent': 1002, 'lastupdated': '2019-01-01T00:00:05'}})) == set()
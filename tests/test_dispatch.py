@@ -0,0 +1,81 @@
+"""Tests of the websocket event dispatcher"""
+
+import asyncio
+
+from deconz_py.deconz_dispatch import DeCONZDispatcher
+
+from helpers import run
+
+def test_drain_waits_for_queued_events():
+    async def scenario():
+        processed = []
+
+        async def callback(event):
+            await asyncio.sleep(0.01)
+            processed.append(event['n'])
+
+        dispatcher = DeCONZDispatcher(callback, workers=2)
+        dispatcher.start()
+        try:
+            for index in range(6):
+                await dispatcher.put({'r': 'sensors', 'id': str(index % 2),
+                                      'n': index})
+            await dispatcher.drain()
+            return list(processed), dispatcher.depth
+        finally:
+            await dispatcher.stop()
+
+    processed, depth = run(scenario())
+    assert sorted(processed) == list(range(6))
+    assert depth == 0
+
+def test_events_of_a_device_keep_their_order():
+    async def scenario():
+        processed = {}
+
+        async def callback(event):
+            # later events of other devices overtake slow ones
+            await asyncio.sleep(0.001 * (event['n'] % 3))
+            processed.setdefault(event['id'], []).append(event['n'])
+
+        dispatcher = DeCONZDispatcher(callback, workers=4)
+        dispatcher.start()
+        try:
+            for index in range(30):
+                await dispatcher.put({'r': 'lights', 'id': str(index % 3),
+                                      'n': index})
+                if index % 4 == 0:
+                    await asyncio.sleep(0)
+            await dispatcher.drain()
+        finally:
+            await dispatcher.stop()
+        return processed
+
+    processed = run(scenario())
+    for dcz_id, numbers in processed.items():
+        assert numbers == list(range(int(dcz_id), 30, 3))
+
+def test_overflow_drops_the_oldest_events():
+    async def scenario():
+        processed = []
+
+        async def callback(event):
+            processed.append(event['n'])
+
+        dispatcher = DeCONZDispatcher(callback, maxsize=3,
+                                      overflow=DeCONZDispatcher.DROP_OLDEST)
+        dispatcher.start()
+        try:
+            # nothing is dispatched before the first await
+            for index, dcz_id in enumerate('aaaab'):
+                await dispatcher.put({'r': 'sensors', 'id': dcz_id,
+                                      'n': index})
+            await dispatcher.drain()
+        finally:
+            await dispatcher.stop()
+        return processed, dispatcher.stats['dropped']
+
+    processed, dropped = run(scenario())
+    # the fourth event of a replaces its oldest, the event of b the next one
+    assert sorted(processed) == [2, 3, 4]
+    assert dropped == 2
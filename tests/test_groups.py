@@ -0,0 +1,46 @@
+"""Tests of planning light commands with groups"""
+
+from deconz_py.deconz_groups import plan_commands
+from fake_gateway import FakeGateway
+
+from helpers import run, settle, start, stop
+
+def _groups(**members):
+    return {group_id: frozenset(lights) for group_id, lights in
+            members.items()}
+
+def test_groups_covering_the_lights_exactly():
+    groups, lights = plan_commands({'1', '2', '3', '4', '5'},
+                                   _groups(a='12', b='34'))
+    assert sorted(groups) == ['a', 'b']
+    assert lights == ['5']
+
+def test_overlapping_groups_do_not_command_a_light_twice():
+    groups, lights = plan_commands({'1', '2', '3', '4', '5'},
+                                   _groups(a='123', b='34', c='45'))
+    assert groups == ['a', 'c']
+    assert lights == []
+
+def test_group_with_other_lights_is_not_used():
+    groups, lights = plan_commands({'1', '2'}, _groups(a='129'))
+    assert groups == []
+    assert lights == ['1', '2']
+
+def test_group_members_follow_websocket_events():
+    async def scenario():
+        gateway, api = await start(FakeGateway(lights=8, groups=2,
+                                               group_size=4))
+        try:
+            lights = ['1', '2', '3', '4']
+            before = await api.async_set_lights(lights, {'on': True})
+            await gateway.push({'e': 'changed', 'r': 'groups', 'id': '1',
+                                't': 'event', 'lights': ['1', '2']})
+            await settle()
+            after = await api.async_set_lights(lights, {'on': False})
+        finally:
+            await stop(gateway, api)
+        return sorted(before), sorted(after)
+
+    before, after = run(scenario())
+    assert before == [('groups', '1')]
+    assert after == [('groups', '1'), ('lights', '3'), ('lights', '4')]
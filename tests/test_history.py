@@ -0,0 +1,31 @@
+"""Tests of the sensor history ring buffer"""
+
+from deconz_py import SensorHistory
+
+def _filled(capacity, readings):
+    history = SensorHistory(capacity)
+    for timestamp, value in readings:
+        history.append(value, timestamp)
+    return history
+
+def test_aggregate_over_wrapped_buffer():
+    history = _filled(4, [(float(second), float(second))
+                          for second in range(10)])
+    assert list(history.export()[1]) == [6.0, 7.0, 8.0, 9.0]
+    assert history.aggregate() == \
+        {'count': 4, 'min': 6.0, 'max': 9.0, 'mean': 7.5}
+    assert history.aggregate(window=1.5, now=9.0) == \
+        {'count': 2, 'min': 8.0, 'max': 9.0, 'mean': 8.5}
+    assert history.aggregate(window=1.0, now=100.0)['count'] == 0
+
+def test_downsample_into_buckets():
+    history = _filled(8, [(0.0, 1.0), (4.0, 3.0), (11.0, 5.0), (12.0, 2.0),
+                          (19.0, 8.0), (31.0, 4.0)])
+    assert history.downsample(10) == [
+        {'start': 0, 'count': 2, 'min': 1.0, 'max': 3.0, 'mean': 2.0},
+        {'start': 10, 'count': 3, 'min': 2.0, 'max': 8.0, 'mean': 5.0},
+        {'start': 30, 'count': 1, 'min': 4.0, 'max': 4.0, 'mean': 4.0}]
+    assert [bucket['start']
+            for bucket in history.downsample(10, window=20, now=31)] == \
+        [10, 30]
+    assert SensorHistory().downsample(60) == []
@@ -0,0 +1,88 @@
+"""Tests of light commands against the fake gateway"""
+
+from deconz_py import RetryPolicy
+from fake_gateway import FakeGateway
+
+from helpers import run, settle, start, stop
+
+def test_failed_command_is_rolled_back():
+    async def scenario():
+        gateway, api = await start(
+            FakeGateway(lights=1),
+            write_retry=RetryPolicy(attempts=1, deadline=1.0))
+        light = api.get_devices('lights')['1']
+        brightness = light.brightness
+        seen = []
+        light.add_update_listener(seen.append)
+        gateway.error_rate = 1.0
+        try:
+            light.brightness = 7
+            result = await light.turn_on()
+        finally:
+            await stop(gateway, api)
+        return result, light, brightness, seen
+
+    result, light, brightness, seen = run(scenario())
+    assert result is False
+    assert light.brightness == brightness
+    assert not light.is_on
+    assert not light.dirty_fields and not light.pending_fields
+    # the optimistic state first, then the rollback
+    assert seen[0]['state'] == {'on': True, 'bri': 7}
+    assert seen[-1]['state'] == {'on': False, 'bri': brightness}
+
+def test_unsent_change_is_replaced_by_gateway_state():
+    async def scenario():
+        gateway, api = await start(FakeGateway(lights=1))
+        light = api.get_devices('lights')['1']
+        try:
+            light.brightness = 50
+            await light.turn_off()
+            await gateway.push({'e': 'changed', 'r': 'lights', 'id': '1',
+                                't': 'event', 'state': {'bri': 200}})
+            await settle()
+        finally:
+            await stop(gateway, api)
+        return light
+
+    light = run(scenario())
+    assert light.brightness == 200
+    assert light.snapshot()['dimmer'] == 200
+    assert not light.pending_fields
+
+def test_unchanged_value_is_not_marked_dirty():
+    async def scenario():
+        gateway, api = await start(FakeGateway(lights=1))
+        light = api.get_devices('lights')['1']
+        try:
+            light.brightness = light.brightness
+            unchanged = light.dirty_fields, light.pending_fields
+            light.brightness = (light.brightness or 0) + 1
+            changed = light.dirty_fields
+        finally:
+            await stop(gateway, api)
+        return unchanged, changed
+
+    unchanged, changed = run(scenario())
+    assert unchanged == (set(), set())
+    assert changed == {'bri'}
+
+def test_turning_on_a_light_that_is_on_notifies_nobody():
+    async def scenario():
+        gateway, api = await start(FakeGateway(lights=1))
+        light = api.get_devices('lights')['1']
+        seen = []
+        light.add_update_listener(seen.append)
+        try:
+            await light.turn_on()
+            await settle()
+            first = list(seen)
+            await light.turn_on()
+            await settle()
+        finally:
+            await stop(gateway, api)
+        return first, seen
+
+    first, seen = run(scenario())
+    assert first == [{'state': {'on': True}}]
+    assert seen == first
@@ -0,0 +1,72 @@
+"""Tests of the update listener fan-out of devices"""
+
+import asyncio
+import time
+
+from deconz_py import DeCONZSensor
+
+from helpers import run
+
+def _sensor():
+    sensor = DeCONZSensor('1', 'Sensor', 'ZHATemperature')
+    run(sensor.update({'state': {'temperature': 2000},
+                       'config': {'battery': 90}}))
+    return sensor
+
+def _update(sensor, temperature):
+    return run(sensor.update({'state': {'temperature': temperature}}))
+
+def test_slow_listener_is_cancelled_after_its_timeout():
+    sensor = _sensor()
+    cancelled = []
+    calls = []
+
+    async def slow(data):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(data)
+            raise
+    sensor.add_update_listener(slow, timeout=0.05)
+    sensor.add_update_listener(calls.append)
+    start = time.monotonic()
+    _update(sensor, 2100)
+    assert time.monotonic() - start < 1
+    assert len(cancelled) == 1
+    assert len(calls) == 1
+
+def test_failing_listeners_do_not_stop_the_others():
+    sensor = _sensor()
+    calls = []
+
+    def broken(data):
+        raise RuntimeError('broken listener')
+
+    async def broken_coroutine(data):
+        raise RuntimeError('broken listener')
+
+    async def working(data):
+        calls.append(data)
+    sensor.add_update_listener(broken)
+    sensor.add_update_listener(broken_coroutine)
+    sensor.add_update_listener(working)
+    _update(sensor, 2100)
+    assert len(calls) == 1
+
+def test_plain_callback_gets_the_changes():
+    sensor = _sensor()
+    calls = []
+    sensor.add_update_listener(lambda data, changed: calls.append(changed),
+                               with_changes=True)
+    _update(sensor, 2100)
+    assert len(calls) == 1
+    assert {'current_state', 'temperature'} <= calls[0]
+
+def test_listener_of_other_attributes_is_skipped():
+    sensor = _sensor()
+    battery = []
+    sensor.add_update_listener(battery.append, attributes=['battery'])
+    _update(sensor, 2100)
+    assert not battery
+    run(sensor.update({'config': {'battery': 80}}))
+    assert len(battery) == 1
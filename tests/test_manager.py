@@ -0,0 +1,51 @@
+"""Tests of DeCONZManager"""
+
+import asyncio
+
+from deconz_py import DeCONZManager
+from fake_gateway import FakeGateway
+
+from helpers import run
+
+def test_restart_after_stop():
+    async def scenario():
+        gateway = FakeGateway(sensors=2, lights=2)
+        await gateway.start()
+        manager = DeCONZManager()
+        try:
+            await manager.async_add_gateway('home', '127.0.0.1', gateway.port,
+                                            gateway.ws_port, gateway.api_key)
+            await manager.async_start()
+            await manager.async_stop()
+            await manager.async_start()
+            devices = manager.get_devices('sensors')
+        finally:
+            await manager.async_stop()
+            await gateway.stop()
+        return devices
+
+    assert len(run(scenario())) == 2
+
+def test_failed_load_stops_its_tasks():
+    async def scenario():
+        gateway = FakeGateway(sensors=1)
+        await gateway.start()
+        manager = DeCONZManager()
+        api = await manager.async_add_gateway(
+            'home', '127.0.0.1', gateway.port, gateway.ws_port,
+            gateway.api_key)
+
+        async def broken(category):
+            raise RuntimeError('load failed')
+        api._async_load_category = broken    # pylint: disable=protected-access
+        await manager.async_start()
+        leftover = [task.get_coro().__qualname__
+                    for task in asyncio.all_tasks() if not task.done()]
+        await manager.async_stop()
+        await gateway.stop()
+        return leftover, api
+
+    leftover, api = run(scenario())
+    assert 'DeCONZApi._ws_listen' not in leftover
+    assert 'DeCONZDispatcher._work' not in leftover
+    assert api.websocket_stats['polling'] is False
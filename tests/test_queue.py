@@ -0,0 +1,93 @@
+"""Tests of the command queue and the scheduler"""
+
+import asyncio
+
+from deconz_py import DeCONZScheduler, RetryPolicy
+from deconz_py.deconz_queue import DeCONZCommandQueue
+from fake_gateway import FakeGateway
+
+from helpers import run, start, stop
+
+def test_scheduler_wait_does_not_count_against_deadline():
+    async def scenario():
+        gateway, api = await start(
+            FakeGateway(lights=40),
+            write_retry=RetryPolicy(attempts=2, deadline=0.5),
+            scheduler=DeCONZScheduler(light_rate=20, light_burst=1))
+        try:
+            results = await api.async_set_lights(
+                api.get_devices('lights'), {'on': True},
+                priority=DeCONZScheduler.BACKGROUND)
+        finally:
+            await stop(gateway, api)
+        return gateway, results
+
+    gateway, results = run(scenario())
+    assert len(results) == 40
+    assert all(result is not False for result in results.values())
+    assert gateway.commands == 40
+
+class _Gateway:
+    """Records the payloads sent, answering with the given results."""
+
+    def __init__(self, results=()):
+        self.sent = []
+        self.release = asyncio.Event()
+        self._results = list(results)
+
+    async def send(self, resource, dcz_id, payload):
+        self.sent.append(dict(payload))
+        await self.release.wait()
+        if self._results:
+            return self._results.pop(0)
+        return [{'success': {key: value}} for key, value in payload.items()]
+
+def test_failed_write_is_folded_into_a_flushed_newer_one():
+    async def scenario():
+        gateway = _Gateway(results=[False])
+        gateway.release.set()
+        queue = DeCONZCommandQueue(
+            gateway.send, window=0.05,
+            retry=RetryPolicy(attempts=3, initial_delay=0.25))
+        first = queue.submit('lights', '1', {'bri': 1})
+        await asyncio.sleep(0.1)
+        # flushed during the backoff of the first command
+        newer = queue.submit('lights', '1', {'bri': 2})
+        return gateway.sent, await first, await newer
+
+    sent, first, newer = run(scenario())
+    assert sent == [{'bri': 1}, {'bri': 2}]
+    assert first == newer
+
+def test_writes_in_the_window_are_merged():
+    async def scenario():
+        gateway = _Gateway()
+        gateway.release.set()
+        queue = DeCONZCommandQueue(gateway.send, window=0.05)
+        futures = [queue.submit('lights', '1', {'on': True}),
+                   queue.submit('lights', '1', {'bri': 10}),
+                   queue.submit('lights', '1', {'bri': 20})]
+        results = await asyncio.gather(*futures)
+        return gateway.sent, results
+
+    sent, results = run(scenario())
+    assert sent == [{'on': True, 'bri': 20}]
+    assert results[0] == results[1] == results[2]
+
+def test_failed_write_is_folded_into_a_newer_one():
+    async def scenario():
+        gateway = _Gateway(results=[False])
+        queue = DeCONZCommandQueue(
+            gateway.send, window=0.2,
+            retry=RetryPolicy(attempts=3, initial_delay=0.01))
+        first = queue.submit('lights', '1', {'on': True, 'bri': 1})
+        await asyncio.sleep(0.25)
+        newer = queue.submit('lights', '1', {'bri': 2})
+        # the first command fails while the newer one is still queued
+        gateway.release.set()
+        return gateway.sent, await first, await newer
+
+    sent, first, newer = run(scenario())
+    # the failed payload is not retried on its own, bri 1 is never replayed
+    assert sent == [{'on': True, 'bri': 1}, {'on': True, 'bri': 2}]
+    assert first == newer
@@ -0,0 +1,35 @@
+"""Tests of the websocket frame recorder"""
+
+from deconz_py import FrameRecorder
+from deconz_py.deconz_recorder import capture_files, read_capture
+
+def test_sessions_are_replayed_back_to_back(tmp_path):
+    path = str(tmp_path / 'capture')
+    recorder = FrameRecorder(path)
+    recorder.record('{"n": 1}', timestamp=100.0)
+    recorder.record('{"n": 2}', timestamp=100.5)
+    recorder.close()
+    # a later run, hours after the first one
+    recorder = FrameRecorder(path)
+    recorder.record('{"n": 3}', timestamp=9000.0)
+    recorder.record('{"n": 4}', timestamp=9000.25)
+    recorder.close()
+
+    frames = list(read_capture(capture_files(path)))
+    assert [frame for _, frame in frames] == \
+        ['{"n": 1}', '{"n": 2}', '{"n": 3}', '{"n": 4}']
+    assert [timestamp for timestamp, _ in frames] == \
+        [100.0, 100.5, 100.5, 100.75]
+
+def test_rotation_keeps_the_timing(tmp_path):
+    path = str(tmp_path / 'capture')
+    recorder = FrameRecorder(path, max_bytes=120, backups=5)
+    for index in range(10):
+        recorder.record('{"n": %d}' % index, timestamp=10.0 * index)
+    recorder.close()
+
+    files = capture_files(path)
+    assert len(files) > 1
+    frames = list(read_capture(files))
+    assert [timestamp for timestamp, _ in frames] == \
+        [10.0 * index for index in range(10)]
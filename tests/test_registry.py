@@ -0,0 +1,44 @@
+"""Tests of the device registry and its indexes"""
+
+from deconz_py import DeCONZSensor
+from deconz_py.deconz_registry import DeCONZRegistry
+
+from helpers import run
+
+class _Exploding(set):
+    """An index entry that fails if a query reads it."""
+
+    def __iter__(self):
+        raise AssertionError('index of another category read')
+
+    def __len__(self):
+        raise AssertionError('index of another category read')
+
+def _sensor(dcz_id, uniqueid, reachable=True):
+    sensor = DeCONZSensor(dcz_id, 'Sensor', 'ZHATemperature')
+    run(sensor.update({'state': {'temperature': 2000}, 'uniqueid': uniqueid,
+                       'config': {'reachable': reachable}}))
+    return sensor
+
+def test_query_reads_the_index_of_its_category_only():
+    registry = DeCONZRegistry()
+    registry.add('sensors', _sensor('1', 'a'))
+    registry.add('sensors', _sensor('2', 'b', reachable=False))
+    # a light with the same id and attribute values
+    registry.add('lights', _sensor('1', 'c'))
+    registry._indexes['lights']['reachable'][True] = \
+        _Exploding()    # pylint: disable=protected-access
+    assert [sensor.dcz_id for sensor in
+            registry.query('sensors', reachable=True)] == ['1']
+    assert len(registry.query(reachable=False)) == 1
+
+def test_uniqueid_index_follows_changes():
+    registry = DeCONZRegistry()
+    sensor = _sensor('1', 'old')
+    registry.add('sensors', sensor)
+    run(sensor.update({'uniqueid': 'new'}))
+    registry.reindex('sensors', sensor)
+    assert registry.by_uniqueid('old') is None
+    assert registry.by_uniqueid('new') is sensor
+    registry.remove('sensors', '1')
+    assert registry.by_uniqueid('new') is None
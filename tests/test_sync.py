@@ -0,0 +1,43 @@
+"""Tests of the blocking DeCONZSyncApi facade"""
+
+import asyncio
+import threading
+
+from deconz_py import DeCONZSyncApi, RetryPolicy
+from fake_gateway import FakeGateway
+
+def _serve(gateway):
+    """Run the gateway on a loop in a thread, return a function stopping it."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(gateway.start(), loop).result(10)
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(gateway.stop(), loop).result(10)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(10)
+        loop.close()
+    return stop
+
+def test_load_can_be_retried_after_a_failure():
+    gateway = FakeGateway(sensors=2, error_rate=1.0)
+    stop_gateway = _serve(gateway)
+    api = DeCONZSyncApi('127.0.0.1', gateway.port, gateway.ws_port,
+                        gateway.api_key, read_retry=RetryPolicy(attempts=1))
+    try:
+        try:
+            api.load(timeout=10)
+        except ConnectionError:
+            pass
+        else:
+            raise AssertionError('load did not fail')
+        gateway.error_rate = 0.0
+        api.load(timeout=10)
+        devices = api.get_devices('sensors')
+        assert sorted(devices) == ['1', '2']
+        # a copy, not the registry the background loop changes
+        assert devices is not api.api.get_devices('sensors')
+    finally:
+        api.stop(timeout=10)
+        stop_gateway()